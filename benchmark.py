@@ -0,0 +1,172 @@
+from ortools.sat.python import cp_model
+from instance import parse_instance
+from model import build_model, FirstSolutionTimer, weighted_violations, build_options_from_params, symmetry_classes, order_symmetric_values
+from heuristic import heuristic_schedule
+from warm_start import add_full_hints
+from patterns import preprocess_pattern, compile_pattern, NameMatcher
+from synthetic import generate_workbook
+from datetime import datetime
+import subprocess
+import argparse
+import tomllib
+import ortools
+import json
+import time
+
+# Times each stage of the scheduler on synthetic workbooks of growing size,
+# and saves the results to JSON so that versions can be compared.
+
+# stage timings compared between result files
+TIMED_STAGES = ['generate', 'parse', 'expand', 'build', 'heuristic', 'first_feasible', 'solve']
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def time_pattern_expansion(sheets, instance):
+    # expands the gap and precedence rows again, on a cold pattern cache
+    compile_pattern.cache_clear()
+    start_time = time.perf_counter()
+    matcher = NameMatcher(instance.exam_names, instance.exam_index)
+    num_pairs = 0
+    for sheet_name in ['מרווחים', 'קדימויות']:
+        for row in sheets[sheet_name][2:]:
+            pattern1, pattern2 = row[1].strip(), row[2].strip()
+            if not (pattern1 and pattern2): continue
+            num_pairs += len(matcher.matching_pairs(preprocess_pattern(pattern1), preprocess_pattern(pattern2)))
+    return time.perf_counter() - start_time, num_pairs
+
+def run_size(num_exams, seed, build_options, time_limit, workers, heuristic_time=0):
+    result = {'size': num_exams}
+
+    start_time = time.perf_counter()
+    sheets = generate_workbook(num_exams, seed)
+    result['generate'] = time.perf_counter() - start_time
+
+    compile_pattern.cache_clear()
+    start_time = time.perf_counter()
+    instance = parse_instance(sheets, lambda message: None)
+    result['parse'] = time.perf_counter() - start_time
+    result['expand'], result['expanded_pairs'] = time_pattern_expansion(sheets, instance)
+    result.update(exams=instance.num_exams, dates=instance.horizon,
+                  gap_rows=len(sheets['מרווחים']) - 2, precedence_rows=len(sheets['קדימויות']) - 2,
+                  min_gaps=len(instance.min_days_between_exams),
+                  ideal_gaps=len(instance.ideal_days_between_exams),
+                  precedences=len(instance.exam_before_exam))
+
+    start_time = time.perf_counter()
+    model, exams, ideal_violations, auxiliary = build_model(instance, build_options)
+    result['build'] = time.perf_counter() - start_time
+    proto = model.Proto()
+    result.update(variables=len(proto.variables), constraints=len(proto.constraints))
+
+    result.update(heuristic=None, heuristic_objective=None)
+    if heuristic_time > 0:
+        # hint the greedy and local-search schedule (first_feasible excludes it)
+        start_time = time.perf_counter()
+        schedule, breaches, objective, _ = heuristic_schedule(instance, heuristic_time)
+        if build_options.get('symmetry_breaking', True):
+            schedule = order_symmetric_values(symmetry_classes(instance), schedule)
+        add_full_hints(model, exams, ideal_violations, auxiliary, instance, schedule)
+        result['heuristic'] = time.perf_counter() - start_time
+        result['heuristic_objective'] = objective if not breaches else None
+
+    solver = cp_model.CpSolver()
+    solver.parameters.max_time_in_seconds = time_limit
+    if workers > 0:
+        solver.parameters.num_workers = workers
+    timer = FirstSolutionTimer()
+    status = solver.SolveWithSolutionCallback(model, timer)
+    result.update(first_feasible=timer.first_solution_time, solve=solver.WallTime(),
+                  status=solver.StatusName(status), objective=None, bound=None)
+    if status in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+        result['objective'] = weighted_violations(instance, [solver.Value(x) for x in exams])
+        result['bound'] = solver.BestObjectiveBound()
+    return result
+
+def compare(old, new):
+    # ratio new/old of each stage's time, for the sizes present in both
+    old_results = {r['size']: r for r in old['results']}
+    print(f'Compared to {old.get("commit")} ({old.get("timestamp")}), new/old time:')
+    print(f'{"size":>8} ' + ' '.join(f'{stage:>15}' for stage in TIMED_STAGES))
+    for r in new['results']:
+        o = old_results.get(r['size'])
+        if o is None: continue
+        ratios = []
+        for stage in TIMED_STAGES:
+            if r.get(stage) is None or not o.get(stage):
+                ratios.append('-')
+            else:
+                ratios.append(f'{r[stage] / o[stage]:.2f}')
+        print(f'{r["size"]:>8} ' + ' '.join(f'{ratio:>15}' for ratio in ratios))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the scheduler on synthetic workbooks')
+    parser.add_argument('--sizes',
+                        type=int,
+                        nargs='+',
+                        default=[100, 300, 1000, 3000, 10000, 20000],
+                        help='Approximate numbers of exams')
+    parser.add_argument('--seed',
+                        type=int,
+                        default=0,
+                        help='Random seed of the generated workbooks')
+    parser.add_argument('--params',
+                        help='Parameters file (for the model build options)')
+    parser.add_argument('--time-limit',
+                        type=float,
+                        default=60,
+                        help='Solver time limit per size (seconds)')
+    parser.add_argument('--workers',
+                        type=int,
+                        default=0,
+                        help='Solver workers (0 == solver default)')
+    parser.add_argument('--heuristic',
+                        type=float,
+                        default=0,
+                        help='Time of the heuristic that hints the solver (seconds, 0 == none)')
+    parser.add_argument('--output',
+                        help='Results JSON file')
+    parser.add_argument('--compare',
+                        help='Previous results JSON file to compare against')
+    args = parser.parse_args()
+
+    params = {}
+    if args.params:
+        with open(args.params, 'rb') as f:
+            params = tomllib.load(f)
+    build_options = build_options_from_params(params)
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'ortools': ortools.__version__,
+        'seed': args.seed,
+        'time_limit': args.time_limit,
+        'workers': args.workers,
+        'heuristic': args.heuristic,
+        'build_options': build_options,
+        'results': [],
+    }
+
+    print(f'{"size":>8} {"exams":>7} {"pairs":>9} {"parse":>8} {"expand":>8} {"build":>8} {"hint":>8} {"first":>8} {"solve":>8} {"status":>10} {"objective":>10}')
+    for size in args.sizes:
+        r = run_size(size, args.seed, build_options, args.time_limit, args.workers, args.heuristic)
+        report['results'].append(r)
+        first = f'{r["first_feasible"]:.2f}' if r['first_feasible'] is not None else '-'
+        hint = str(r['heuristic_objective']) if r['heuristic_objective'] is not None else '-'
+        print(f'{size:>8} {r["exams"]:>7} {r["expanded_pairs"]:>9} {r["parse"]:>8.2f} {r["expand"]:>8.2f} {r["build"]:>8.2f} {hint:>8} '
+              f'{first:>8} {r["solve"]:>8.2f} {r["status"]:>10} {str(r["objective"]):>10}')
+
+        # rewrite after every size, so a long run can be interrupted
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
@@ -0,0 +1,79 @@
+from ortools.sat.python import cp_model
+from instance import INPUT_SHEETS, parse_instance, load_snapshot
+from model import build_model, FirstSolutionTimer, weighted_violations, IDEAL_GAP_ENCODINGS, CAPACITY_ENCODINGS
+from workbook import FakeWorkbook
+import argparse
+import time
+
+# Builds and solves the same instance under each value of a model build
+# option, and reports model size, time to first feasible and final objective.
+
+# build options that can be compared, and their values
+COMPARABLE_OPTIONS = {
+    'ideal_gap_encoding': list(IDEAL_GAP_ENCODINGS),
+    'min_gap_cliques': [True, False],
+    'capacity_encoding': list(CAPACITY_ENCODINGS),
+    'symmetry_breaking': [True, False],
+    'tighten_domains': [True, False],
+}
+
+### Read args
+parser = argparse.ArgumentParser(description='Compare model build options on one instance')
+parser.add_argument('--snapshot',
+                    help='Instance snapshot file')
+parser.add_argument('--workbook',
+                    help='Local JSON workbook')
+parser.add_argument('--option',
+                    default='ideal_gap_encoding',
+                    choices=sorted(COMPARABLE_OPTIONS),
+                    help='Build option to compare')
+parser.add_argument('--values',
+                    nargs='+',
+                    help='Option values to compare (default: all)')
+parser.add_argument('--time-limit',
+                    type=float,
+                    default=60,
+                    help='Solver time limit per run (seconds)')
+parser.add_argument('--workers',
+                    type=int,
+                    default=0,
+                    help='Solver workers (0 == solver default)')
+args = parser.parse_args()
+if not (args.snapshot or args.workbook):
+    parser.error('one of --snapshot or --workbook is required')
+
+if args.snapshot:
+    instance = load_snapshot(args.snapshot)
+else:
+    sheets = FakeWorkbook.from_json(args.workbook).read_sheets(INPUT_SHEETS)
+    instance = parse_instance(sheets, print)
+
+values = COMPARABLE_OPTIONS[args.option]
+if args.values:
+    # values given on the command line are strings
+    values = [v for v in values if str(v).lower() in [a.lower() for a in args.values]]
+
+print(f'{instance.num_exams} exams, {instance.horizon} dates, '
+      f'{len(instance.min_days_between_exams)} minimal gaps, {len(instance.ideal_days_between_exams)} ideal gaps')
+
+header = f'{args.option:>20} {"variables":>10} {"constraints":>12} {"build (s)":>10} {"first (s)":>10} {"solve (s)":>10} {"status":>10} {"objective":>10}'
+print(header)
+for value in values:
+    start_time = time.perf_counter()
+    model, exams, ideal_violations, _ = build_model(instance, {args.option: value})
+    build_time = time.perf_counter() - start_time
+    proto = model.Proto()
+
+    solver = cp_model.CpSolver()
+    solver.parameters.max_time_in_seconds = args.time_limit
+    if args.workers > 0:
+        solver.parameters.num_workers = args.workers
+    timer = FirstSolutionTimer()
+    status = solver.SolveWithSolutionCallback(model, timer)
+
+    first = f'{timer.first_solution_time:.2f}' if timer.first_solution_time is not None else '-'
+    objective = '-'
+    if status in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+        objective = weighted_violations(instance, [solver.Value(x) for x in exams])
+    print(f'{str(value):>20} {len(proto.variables):>10} {len(proto.constraints):>12} {build_time:>10.2f} '
+          f'{first:>10} {solver.WallTime():>10.2f} {solver.StatusName(status):>10} {objective:>10}')
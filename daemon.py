@@ -0,0 +1,311 @@
+import os
+import json
+import time
+import queue
+import tomllib
+import argparse
+import threading
+import itertools
+import gspread
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from google.oauth2 import service_account
+from ortools.sat.python import cp_model
+from instance import INPUT_SHEETS, parse_instance, load_snapshot
+from model import build_model, build_options_from_params, symmetry_classes, order_symmetric_values
+from evaluate import ScheduleEvaluator
+from heuristic import heuristic_schedule
+from warm_start import add_full_hints
+from solve_job import SolveJob
+from workbook import GSheetWorkbook, FakeWorkbook
+
+#### Scheduler daemon ####
+# A long-running process that takes scheduling jobs over a local HTTP API,
+# queues them and solves at most `max_jobs` at a time, each with an equal
+# share of the cores. Imports and credentials are set up once.
+#
+#   POST   /jobs              {"workbook": "wb.json"} or {"snapshot": "x.npz"}
+#                             or {"sheet_url": "https://..."}, with optional
+#                             "params" (as in params.toml) or "params_file"
+#   GET    /jobs              all jobs
+#   GET    /jobs/<id>         status, incumbent objective and bound
+#   GET    /jobs/<id>/result  schedule and violations of a finished job
+#   DELETE /jobs/<id>         cancel (a running job keeps its best schedule)
+#
+# Only the latest `keep_jobs` finished jobs are kept.
+
+SOURCES = ('workbook', 'snapshot', 'sheet_url')
+
+
+class Job:
+    def __init__(self, job_id, request):
+        self.id = job_id
+        self.request = request
+        self.status = 'queued'
+        self.submitted = time.time()
+        self.started = self.finished = None
+        self.error = None
+        self.log = []
+        self.solve_job = None
+        self.result = None
+        self.cancelled = False
+        # latest (wall time, objective, bound), kept once the solver is released
+        self.progress = []
+
+    def release(self):
+        # drop the solver and model of a finished job, keeping its progress
+        if self.solve_job is not None:
+            self.progress = self.solve_job.progress
+            self.solve_job = None
+
+    def summary(self):
+        summary = {'id': self.id, 'status': self.status, 'submitted': self.submitted,
+                   'started': self.started, 'finished': self.finished, 'error': self.error,
+                   'objective': None, 'bound': None, 'solutions': 0, 'log': self.log[-20:]}
+        progress = self.solve_job.progress if self.solve_job is not None else self.progress
+        if progress:
+            _, summary['objective'], summary['bound'] = progress[-1]
+            summary['solutions'] = len(progress)
+        if self.result is not None:
+            summary['objective'] = self.result['objective']
+        return summary
+
+
+class Daemon:
+    def __init__(self, cores=None, max_jobs=1, max_time_limit=0, gc=None, keep_jobs=100):
+        self.cores = cores or os.cpu_count() or 1
+        self.max_jobs = max(1, min(max_jobs, self.cores))
+        self.max_time_limit = max_time_limit
+        self.keep_jobs = keep_jobs
+        self.gc = gc
+        self.jobs = {}
+        self.__ids = itertools.count(1)
+        self.__lock = threading.Lock()
+        self.__queue = queue.Queue()
+        for _ in range(self.max_jobs):
+            threading.Thread(target=self.__work, daemon=True).start()
+
+    def submit(self, request):
+        if not isinstance(request, dict):
+            raise ValueError('a job must be a JSON object')
+        if not isinstance(request.get('params', {}), dict):
+            raise ValueError('params must be a JSON object')
+        sources = [key for key in SOURCES if request.get(key)]
+        if len(sources) != 1:
+            raise ValueError(f'exactly one of {", ".join(SOURCES)} is required')
+        if 'sheet_url' in sources and self.gc is None:
+            raise ValueError('sheet_url jobs need the daemon to be started with --secrets')
+        with self.__lock:
+            job = Job(str(next(self.__ids)), request)
+            self.jobs[job.id] = job
+        self.__queue.put(job)
+        return job
+
+    def cancel(self, job):
+        job.cancelled = True
+        if job.solve_job is not None:
+            job.solve_job.cancel()
+        elif job.status == 'queued':
+            job.status = 'cancelled'
+            job.finished = time.time()
+            self.__evict()
+
+    def __evict(self):
+        # forget the oldest finished jobs beyond `keep_jobs`
+        with self.__lock:
+            finished = [job for job in self.jobs.values() if job.finished is not None]
+            for job in sorted(finished, key=lambda job: job.finished)[:max(0, len(finished) - self.keep_jobs)]:
+                del self.jobs[job.id]
+
+    def __work(self):
+        while True:
+            job = self.__queue.get()
+            if job.cancelled: continue
+            job.status = 'running'
+            job.started = time.time()
+            try:
+                self.run(job)
+                job.status = 'cancelled' if job.cancelled else 'done'
+            except Exception as e:
+                job.status = 'failed'
+                job.error = f'{type(e).__name__}: {e}'
+            job.release()
+            job.finished = time.time()
+            self.__evict()
+
+    def load_instance(self, request, log):
+        if request.get('snapshot'):
+            return load_snapshot(request['snapshot'])
+        if request.get('workbook'):
+            workbook = FakeWorkbook.from_json(request['workbook'])
+        else:
+            workbook = GSheetWorkbook.open(self.gc, request['sheet_url'])
+        return parse_instance(workbook.read_sheets(list(INPUT_SHEETS)), log)
+
+    def run(self, job):
+        def log(line):
+            job.log.append(line)
+
+        request = job.request
+        params = {}
+        if request.get('params_file'):
+            with open(request['params_file'], 'rb') as f:
+                params = tomllib.load(f)
+        params.update(request.get('params', {}))
+
+        instance = self.load_instance(request, log)
+        build_options = build_options_from_params(params)
+        model, exams, ideal_violations, auxiliary = build_model(instance, build_options, log)
+
+        heuristic_time = params.get('heuristic_time_in_secs', 0)
+        if heuristic_time > 0 and not job.cancelled:
+            schedule, breaches, objective, _ = heuristic_schedule(instance, heuristic_time)
+            if build_options['symmetry_breaking']:
+                schedule = order_symmetric_values(symmetry_classes(instance), schedule)
+            add_full_hints(model, exams, ideal_violations, auxiliary, instance, schedule)
+            log(f'Heuristic: objective value {objective}, {breaches} hard constraints broken')
+
+        time_limit = params.get('time_limit_in_mins', 1) * 60.0
+        if self.max_time_limit > 0:
+            time_limit = min(time_limit, self.max_time_limit) if time_limit > 0 else self.max_time_limit
+        solve_job = SolveJob(model, time_limit, watched=exams)
+        solve_job.solver.parameters.num_workers = max(1, self.cores // self.max_jobs)
+        if params.get('absolute_gap_limit', 0) > 0:
+            solve_job.solver.parameters.absolute_gap_limit = params['absolute_gap_limit']
+        job.solve_job = solve_job
+        if job.cancelled: return
+        solve_job.start()
+        # stopping a search that has not begun yet has no effect, so a cancel
+        # is re-issued until the solve ends
+        while not solve_job.wait(0.1):
+            if job.cancelled: solve_job.cancel()
+        if solve_job.error is not None:
+            raise solve_job.error
+
+        status = solve_job.status
+        log(f'Solver status: {solve_job.solver.StatusName(status)} after {solve_job.elapsed():.1f} s')
+        result = {'status': solve_job.solver.StatusName(status), 'objective': None, 'bound': None,
+                  'schedule': {}, 'violations': []}
+        if status in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+            values = [solve_job.solver.Value(x) for x in exams]
+            evaluator = ScheduleEvaluator(instance)
+            names, dates = instance.exam_names, instance.dates
+            result.update(objective=int(evaluator.evaluate(values).objective[0]),
+                          bound=solve_job.solver.BestObjectiveBound(),
+                          # 'dummy' exams are omitted, as in the output sheet
+                          schedule={name: dates[t] for name, t in zip(names, values) if not name.startswith('%')},
+                          violations=[list(v) for v in evaluator.violations(values, names)])
+        job.result = result
+
+
+class _Handler(BaseHTTPRequestHandler):
+    daemon = None
+
+    def send_json(self, code, body):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def job(self, parts):
+        job = self.daemon.jobs.get(parts[1]) if len(parts) > 1 else None
+        if job is None:
+            self.send_json(404, {'error': 'no such job'})
+        return job
+
+    def do_GET(self):
+        parts = self.path.strip('/').split('/')
+        if parts == ['jobs']:
+            self.send_json(200, [job.summary() for job in list(self.daemon.jobs.values())])
+        elif parts[0] == 'jobs' and len(parts) == 2:
+            job = self.job(parts)
+            if job: self.send_json(200, job.summary())
+        elif parts[0] == 'jobs' and len(parts) == 3 and parts[2] == 'result':
+            job = self.job(parts)
+            if not job: return
+            if job.result is None:
+                self.send_json(409, {'error': f'job is {job.status}'})
+            else:
+                self.send_json(200, job.result)
+        else:
+            self.send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if self.path.strip('/') != 'jobs':
+            return self.send_json(404, {'error': 'not found'})
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length) or b'{}')
+            job = self.daemon.submit(request)
+        except ValueError as e:
+            return self.send_json(400, {'error': str(e)})
+        self.send_json(202, job.summary())
+
+    def do_DELETE(self):
+        parts = self.path.strip('/').split('/')
+        if parts[0] != 'jobs' or len(parts) != 2:
+            return self.send_json(404, {'error': 'not found'})
+        job = self.job(parts)
+        if job:
+            self.daemon.cancel(job)
+            self.send_json(200, job.summary())
+
+    def log_message(self, format, *args):
+        print(f'{self.address_string()} {format % args}')
+
+
+def serve(daemon, host='127.0.0.1', port=8765):
+    handler = type('Handler', (_Handler,), {'daemon': daemon})
+    server = ThreadingHTTPServer((host, port), handler)
+    print(f'Serving on http://{host}:{server.server_port} '
+          f'({daemon.max_jobs} jobs at a time on {daemon.cores} cores)')
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Scheduler daemon with a local HTTP API')
+    parser.add_argument('--host',
+                        default='127.0.0.1',
+                        help='Address to listen on (local only by default)')
+    parser.add_argument('--port',
+                        type=int,
+                        default=8765,
+                        help='Port to listen on')
+    parser.add_argument('--cores',
+                        type=int,
+                        default=os.cpu_count() or 1,
+                        help='Cores shared by the running jobs')
+    parser.add_argument('--max-jobs',
+                        type=int,
+                        default=1,
+                        help='Jobs solved at a time (the rest wait in the queue)')
+    parser.add_argument('--max-time-limit',
+                        type=float,
+                        default=0,
+                        help='Upper bound on the time limit of a job (seconds, 0 == none)')
+    parser.add_argument('--keep-jobs',
+                        type=int,
+                        default=100,
+                        help='Finished jobs (and results) kept for the API; older ones are dropped')
+    parser.add_argument('--secrets',
+                        help='TOML secrets file, for jobs on Google Sheets')
+    args = parser.parse_args()
+
+    gc = None
+    if args.secrets:
+        with open(args.secrets, 'rb') as f:
+            secrets = tomllib.load(f)
+        credentials = service_account.Credentials.from_service_account_info(
+            secrets["gcp_service_account"],
+            scopes=[
+                "https://www.googleapis.com/auth/spreadsheets",
+            ],
+        )
+        gc = gspread.authorize(credentials)
+
+    server = serve(Daemon(args.cores, args.max_jobs, args.max_time_limit, gc, args.keep_jobs), args.host, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,112 @@
+import numpy as np
+from dataclasses import dataclass
+
+#### Schedule evaluation ####
+# Checks assignments (a date index per exam) against an instance without a
+# solver: the constraints are held as arrays of exam pairs, and a batch of
+# schedules (one per row) is evaluated in a few vectorized passes.
+
+def _pairs(items):
+    # {(i, j): v} -> (pairs, values), skipping non-positive values
+    items = [(i, j, v) for (i, j), v in items if v > 0]
+    table = np.array(items, dtype=np.int64).reshape(-1, 3)
+    return table[:, :2], table[:, 2]
+
+
+@dataclass
+class Evaluation:
+    # one row per schedule (a single row for a single schedule)
+    load: np.ndarray             # demand per date
+    over_capacity: np.ndarray    # date over capacity (bool per date)
+    fixed_breaches: np.ndarray   # exam off its fixed date (bool per fixed exam)
+    min_breaches: np.ndarray     # gap below the minimal one (bool per pair)
+    before_breaches: np.ndarray  # precedence reversed (bool per pair)
+    gaps: np.ndarray             # actual gap per ideal-gap pair
+    ideal_violations: np.ndarray # gap below the ideal one (bool per pair)
+    objective: np.ndarray        # weighted ideal-gap violations
+
+    @property
+    def breaches(self):
+        # number of hard constraints broken
+        return (self.over_capacity.sum(axis=1) + self.fixed_breaches.sum(axis=1) +
+                self.min_breaches.sum(axis=1) + self.before_breaches.sum(axis=1))
+
+    @property
+    def feasible(self):
+        return self.breaches == 0
+
+
+class ScheduleEvaluator:
+    """Evaluates schedules of `instance`: arrays of shape (num_exams,) or
+    (num_schedules, num_exams) holding a date index per exam."""
+
+    def __init__(self, instance):
+        self.instance = instance
+        self.horizon = instance.horizon
+        self.demands = np.array(instance.exam_demands, dtype=np.int64)
+        self.capacity = np.array(instance.dates_capacity, dtype=np.int64)
+        fixed = np.array(list(instance.exam_on_date.items()), dtype=np.int64).reshape(-1, 2)
+        self.fixed_exams, self.fixed_dates = fixed[:, 0], fixed[:, 1]
+        self.min_pairs, self.min_days = _pairs(instance.min_days_between_exams.items())
+        self.before_pairs = np.array(instance.exam_before_exam, dtype=np.int64).reshape(-1, 2)
+        self.ideal_pairs, self.ideal_days = _pairs(instance.ideal_days_between_exams.items())
+        self.weights = np.array([instance.weights[(int(i), int(j))] for i, j in self.ideal_pairs], dtype=np.int64)
+
+    def evaluate(self, schedules):
+        values = np.atleast_2d(np.asarray(schedules, dtype=np.int64))
+        count = len(values)
+
+        # load per date: one bincount over (schedule, date) cells
+        cells = values + self.horizon * np.arange(count)[:, None]
+        load = np.bincount(cells.ravel(), weights=np.tile(self.demands, count),
+                           minlength=count * self.horizon).reshape(count, self.horizon).astype(np.int64)
+
+        gap = lambda pairs: np.abs(values[:, pairs[:, 0]] - values[:, pairs[:, 1]])
+        gaps = gap(self.ideal_pairs)
+        ideal_violations = gaps < self.ideal_days
+        return Evaluation(
+            load=load,
+            over_capacity=load > self.capacity,
+            fixed_breaches=values[:, self.fixed_exams] != self.fixed_dates,
+            min_breaches=gap(self.min_pairs) < self.min_days,
+            before_breaches=values[:, self.before_pairs[:, 0]] > values[:, self.before_pairs[:, 1]],
+            gaps=gaps,
+            ideal_violations=ideal_violations,
+            objective=ideal_violations.astype(np.int64) @ self.weights,
+        )
+
+    def violations(self, values, exam_names):
+        """The ideal-gap violations of one schedule, as
+        (exam1, exam2, requested gap, actual gap) rows."""
+        evaluation = self.evaluate(values)
+        violated = np.flatnonzero(evaluation.ideal_violations[0])
+        return [(exam_names[self.ideal_pairs[k, 0]], exam_names[self.ideal_pairs[k, 1]],
+                 int(self.ideal_days[k]), int(evaluation.gaps[0, k])) for k in violated]
+
+    def pair_table(self):
+        """(pairs, min days, ideal days) over all pairs with a minimal or an
+        ideal gap, sorted; a missing gap is 0."""
+        pairs, inverse = np.unique(np.concatenate([self.min_pairs, self.ideal_pairs]), axis=0, return_inverse=True)
+        inverse = inverse.ravel()
+        min_days = np.zeros(len(pairs), dtype=np.int64)
+        ideal_days = np.zeros(len(pairs), dtype=np.int64)
+        min_days[inverse[:len(self.min_pairs)]] = self.min_days
+        ideal_days[inverse[len(self.min_pairs):]] = self.ideal_days
+        return pairs, min_days, ideal_days
+
+    def describe_breaches(self, values):
+        """Lines naming the hard constraints one schedule breaks."""
+        evaluation = self.evaluate(values)
+        names, dates = self.instance.exam_names, self.instance.dates
+        lines = []
+        for t in np.flatnonzero(evaluation.over_capacity[0]):
+            lines.append(f'{dates[t]}: load {evaluation.load[0, t]} over capacity {self.capacity[t]}')
+        for k in np.flatnonzero(evaluation.fixed_breaches[0]):
+            lines.append(f'{names[self.fixed_exams[k]]} not on its fixed date {dates[self.fixed_dates[k]]}')
+        for k in np.flatnonzero(evaluation.min_breaches[0]):
+            i, j = self.min_pairs[k]
+            lines.append(f'{names[i]} and {names[j]} less than {self.min_days[k]} days apart')
+        for k in np.flatnonzero(evaluation.before_breaches[0]):
+            i, j = self.before_pairs[k]
+            lines.append(f'{names[i]} after {names[j]}')
+        return lines
@@ -0,0 +1,166 @@
+import time
+from ortools.sat.python import cp_model
+
+#### Infeasibility explanation ####
+# Every hard constraint group that comes from one sheet row (a fixed date, a
+# minimal-gap row, a precedence row, a date's capacity) is posted under its
+# own assumption literal, in a model without the objective. If it is
+# infeasible, the solver returns a subset of the assumptions that suffices
+# for infeasibility, which is then shrunk by dropping one assumption at a
+# time while the rest remain infeasible.
+
+SHEET_NAMES = {'capacity': 'תאריכים', 'fix': 'קיבועים', 'min': 'מרווחים', 'before': 'קדימויות'}
+
+def _group(instance, kind, key):
+    # constraints from the same row share an assumption; without a known row
+    # (e.g. an instance from a snapshot), each constraint has its own
+    row = instance.rows.get((kind, key))
+    return (kind, row, None) if row is not None else (kind, None, key)
+
+def build_explain_model(instance, only=None):
+    """Returns the hard-constraint model and {(kind, row, key): (literal, keys)},
+    where keys are those of the constraints under that literal. Given `only`,
+    a set of (kind, key), just those constraints are posted, each under its
+    own literal (with key in its group)."""
+    model = cp_model.CpModel()
+    horizon = instance.horizon
+    exams = [model.NewIntVar(0, horizon-1, f'exam_{i}') for i in range(instance.num_exams)]
+
+    groups = {}
+    def literal(kind, key):
+        if only is not None:
+            if (kind, key) not in only: return None
+            group = (kind, instance.rows.get((kind, key)), key)
+        else:
+            group = _group(instance, kind, key)
+        if group not in groups:
+            groups[group] = (model.NewBoolVar(f'{kind}_{len(groups)}'), [])
+        groups[group][1].append(key)
+        return groups[group][0]
+
+    for i, t in instance.exam_on_date.items():
+        lit = literal('fix', i)
+        if lit is None: continue
+        model.Add(exams[i] == t).OnlyEnforceIf(lit)
+
+    for (i, j), days in instance.min_days_between_exams.items():
+        if days < 1: continue
+        present = literal('min', (i, j))
+        if present is None: continue
+        interval_i = model.NewOptionalFixedSizeIntervalVar(exams[i], days, present, f'mingap_{i,j}')
+        interval_j = model.NewOptionalFixedSizeIntervalVar(exams[j], days, present, f'mingap_{j,i}')
+        model.AddNoOverlap([interval_i, interval_j])
+
+    for i, j in instance.exam_before_exam:
+        lit = literal('before', (i, j))
+        if lit is None: continue
+        model.Add(exams[i] <= exams[j]).OnlyEnforceIf(lit)
+
+    # capacities: a cumulative as large as the total demand, padded on each
+    # date by an interval present only if its capacity is enforced
+    total_demand = sum(instance.exam_demands)
+    intervals = [model.NewFixedSizeIntervalVar(var, 1, f'demand_{i}') for i, var in enumerate(exams)]
+    demands = list(instance.exam_demands)
+    for t, capacity in enumerate(instance.dates_capacity):
+        if capacity >= total_demand: continue
+        present = literal('capacity', t)
+        if present is None: continue
+        intervals.append(model.NewOptionalFixedSizeIntervalVar(t, 1, present, f'capacity_{t}'))
+        demands.append(total_demand - capacity)
+    model.AddCumulative(intervals, demands, total_demand)
+
+    return model, groups
+
+
+def _check(model, assumptions, time_limit):
+    model.ClearAssumptions()
+    model.AddAssumptions(assumptions)
+    solver = cp_model.CpSolver()
+    solver.parameters.num_workers = 1
+    if time_limit > 0:
+        solver.parameters.max_time_in_seconds = time_limit
+    status = solver.Solve(model)
+    return status, solver
+
+
+def _shrink(model, groups, core, deadline):
+    # deletion: drop each group whose removal keeps the rest infeasible (no
+    # deadline == no time limit)
+    literals = {lit.Index(): group for group, (lit, _) in groups.items()}
+    k = 0
+    while k < len(core):
+        time_limit = 0
+        if deadline is not None:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0: break
+            time_limit = min(remaining, 10)
+        candidate = core[:k] + core[k+1:]
+        check, check_solver = _check(model, [groups[g][0] for g in candidate], time_limit)
+        if check == cp_model.INFEASIBLE:
+            # the new core may be smaller still
+            smaller = {literals[i] for i in check_solver.SufficientAssumptionsForInfeasibility() if i in literals}
+            core = [g for g in candidate if g in smaller] if smaller else candidate
+            k = min(k, len(core))
+        else:
+            k += 1
+    return core
+
+
+def explain_infeasibility(instance, time_limit=60, log=print):
+    """Returns (status, solver, conflict): the status of the hard constraints,
+    the solver of the first check and, if infeasible, a small list of
+    constraint groups that cannot all hold, as ((kind, row, key), keys), where
+    keys are the constraints of the group within the conflict. A time limit
+    of 0 means none."""
+    deadline = time.perf_counter() + time_limit if time_limit > 0 else None
+    model, groups = build_explain_model(instance)
+    literals = {lit.Index(): group for group, (lit, _) in groups.items()}
+
+    status, solver = _check(model, [lit for lit, _ in groups.values()], time_limit)
+    if status != cp_model.INFEASIBLE:
+        return status, solver, []
+
+    core = [literals[k] for k in solver.SufficientAssumptionsForInfeasibility() if k in literals]
+    log(f'Explain: {len(core)} of {len(groups)} constraint rows suffice for infeasibility, shrinking...')
+    core = _shrink(model, groups, core, deadline)
+    conflict = [(group, groups[group][1]) for group in core]
+
+    # rows of several constraints (expanded patterns): shrink to the
+    # constraints themselves, posting only those of the conflicting rows
+    if any(len(keys) > 1 for _, keys in conflict):
+        only = {(group[0], key) for group, keys in conflict for key in keys}
+        model, key_groups = build_explain_model(instance, only)
+        key_literals = {lit.Index(): group for group, (lit, _) in key_groups.items()}
+        remaining = 0 if deadline is None else deadline - time.perf_counter()
+        if deadline is None or remaining > 0:
+            check, check_solver = _check(model, [lit for lit, _ in key_groups.values()], remaining)
+            if check == cp_model.INFEASIBLE:
+                key_core = [key_literals[k] for k in check_solver.SufficientAssumptionsForInfeasibility() if k in key_literals]
+                kept = {(kind, key) for kind, _, key in _shrink(model, key_groups, key_core, deadline)}
+                conflict = [(group, [key for key in keys if (group[0], key) in kept]) for group, keys in conflict]
+                conflict = [(group, keys) for group, keys in conflict if keys]
+
+    return status, solver, conflict
+
+
+def describe_conflict(instance, group, keys):
+    """A line naming the sheet row (if known) and the constraints of a group
+    that are in the conflict."""
+    kind, row, _ = group
+    names = instance.exam_names
+    descriptions = []
+    for key in keys[:3]:
+        if kind == 'capacity':
+            descriptions.append(f'capacity {instance.dates_capacity[key]} on {instance.dates[key]}')
+        elif kind == 'fix':
+            descriptions.append(f'{names[key]} on {instance.dates[instance.exam_on_date[key]]}')
+        elif kind == 'min':
+            i, j = key
+            descriptions.append(f'{instance.min_days_between_exams[key]} days between {names[i]} and {names[j]}')
+        else:
+            i, j = key
+            descriptions.append(f'{names[i]} not after {names[j]}')
+    if len(keys) > 3:
+        descriptions.append(f'... ({len(keys)} pairs)')
+    location = f'Sheet {SHEET_NAMES[kind]}, row {row}' if row is not None else f'Sheet {SHEET_NAMES[kind]}'
+    return f'{location}: ' + '; '.join(descriptions)
@@ -0,0 +1,189 @@
+import time
+import random
+import numpy as np
+from model import date_windows
+from evaluate import ScheduleEvaluator
+
+#### Heuristic pre-solve ####
+# A greedy date assignment (most constrained exams first, each on its
+# cheapest consistent date) followed by a time-boxed local search over moves
+# (an exam to its cheapest date) and swaps (two exams exchange dates). Costs
+# are those of the model: hard constraints broken first, then the weighted
+# ideal-gap violations. The schedule is meant as a full hint for the solver.
+
+# cost of a broken hard constraint, in objective units
+BREACH_COST = 1_000_000
+
+
+def _adjacency(num_exams, items):
+    # {(i, j): (days, weight)} -> per exam (neighbours, days, weights) arrays
+    lists = [([], [], []) for _ in range(num_exams)]
+    for (i, j), (days, weight) in items:
+        for a, b in ((i, j), (j, i)):
+            lists[a][0].append(b)
+            lists[a][1].append(days)
+            lists[a][2].append(weight)
+    return [tuple(np.array(l, dtype=np.int64) for l in lists[i]) for i in range(num_exams)]
+
+
+class LocalSearch:
+    def __init__(self, instance, seed=0):
+        self.instance = instance
+        self.num_exams, self.horizon = instance.num_exams, instance.horizon
+        self.demands = np.array(instance.exam_demands, dtype=np.int64)
+        self.capacity = np.array(instance.dates_capacity, dtype=np.int64)
+        self.dates = np.arange(self.horizon)
+        self.random = random.Random(seed)
+
+        # dates within the windows of the precedences, with enough capacity
+        # (the domains of the model)
+        earliest, latest = date_windows(instance)
+        self.allowed = np.zeros((self.num_exams, self.horizon), dtype=bool)
+        for i in range(self.num_exams):
+            self.allowed[i, earliest[i]:latest[i]+1] = True
+        self.allowed &= self.capacity[None, :] >= self.demands[:, None]
+        for i, t in instance.exam_on_date.items():
+            self.allowed[i] = False
+            self.allowed[i, t] = True
+        self.movable = [i for i in range(self.num_exams) if i not in instance.exam_on_date]
+        self.movable_set = set(self.movable)
+
+        self.min_gaps = _adjacency(self.num_exams, [(pair, (days, 1)) for pair, days in
+                                                    instance.min_days_between_exams.items() if days > 0])
+        self.ideal_gaps = _adjacency(self.num_exams, [(pair, (days, instance.weights[pair])) for pair, days in
+                                                      instance.ideal_days_between_exams.items() if days > 0])
+        predecessors = [[] for _ in range(self.num_exams)]
+        successors = [[] for _ in range(self.num_exams)]
+        for i, j in instance.exam_before_exam:
+            successors[i].append(j)
+            predecessors[j].append(i)
+        self.predecessors = [np.array(p, dtype=np.int64) for p in predecessors]
+        self.successors = [np.array(s, dtype=np.int64) for s in successors]
+
+        self.evaluator = ScheduleEvaluator(instance)
+        self.schedule = np.full(self.num_exams, -1, dtype=np.int64)
+        self.load = np.zeros(self.horizon, dtype=np.int64)
+
+    def costs(self, i, with_capacity=True):
+        """Cost of exam i on each date, given the dates of the other placed
+        exams (unplaced exams, marked -1, are ignored)."""
+        x = self.schedule
+        breaches = (~self.allowed[i]).astype(np.int64)
+        if with_capacity:
+            load = self.load.copy()
+            if x[i] >= 0: load[x[i]] -= self.demands[i]
+            breaches += load + self.demands[i] > self.capacity
+
+        exams, days, _ = self.min_gaps[i]
+        placed = x[exams] >= 0
+        breaches += (np.abs(self.dates[:, None] - x[exams[placed]]) < days[placed]).sum(axis=1)
+        before = x[self.predecessors[i]]
+        after = x[self.successors[i]]
+        breaches += (self.dates[:, None] < before[before >= 0]).sum(axis=1)
+        breaches += (self.dates[:, None] > after[after >= 0]).sum(axis=1)
+
+        exams, days, weights = self.ideal_gaps[i]
+        placed = x[exams] >= 0
+        violations = (np.abs(self.dates[:, None] - x[exams[placed]]) < days[placed]) @ weights[placed]
+        return breaches * BREACH_COST + violations
+
+    def place(self, i, t):
+        if self.schedule[i] >= 0:
+            self.load[self.schedule[i]] -= self.demands[i]
+        self.schedule[i] = t
+        self.load[t] += self.demands[i]
+
+    def greedy(self):
+        # fixed exams first, then by the number of allowed dates and degree
+        for i, t in self.instance.exam_on_date.items():
+            self.place(i, t)
+        degree = [len(self.min_gaps[i][0]) + len(self.ideal_gaps[i][0]) for i in range(self.num_exams)]
+        order = sorted(self.movable, key=lambda i: (self.allowed[i].sum(), -degree[i], i))
+        for i in order:
+            # ties go to the least loaded date
+            costs = self.costs(i) + self.load / np.maximum(self.capacity, 1)
+            self.place(i, int(np.argmin(costs)))
+
+    def move(self, i):
+        costs = self.costs(i)
+        t = int(np.argmin(costs))
+        if costs[t] < costs[self.schedule[i]]:
+            self.place(i, t)
+            return True
+        return False
+
+    def swap(self, i):
+        # exchange dates with an exam on one of i's cheapest dates, ignoring
+        # capacity (a swap keeps the loads of similar exams)
+        x = self.schedule
+        costs = self.costs(i, with_capacity=False)
+        targets = [t for t in np.argsort(costs, kind='stable')[:3] if t != x[i] and costs[t] < costs[x[i]]]
+        if not targets: return False
+        t = int(self.random.choice(targets))
+        candidates = [j for j in np.flatnonzero(x == t) if j in self.movable_set]
+        if not candidates: return False
+        j = int(self.random.choice(candidates))
+
+        s = int(x[i])
+        before = self.costs(i)[s] + self.costs(j)[t]
+        self.place(i, t)
+        self.place(j, s)
+        after = self.costs(i)[t] + self.costs(j)[s]
+        if after < before or (after == before and self.random.random() < 0.3):
+            return True
+        # undo
+        self.place(j, t)
+        self.place(i, s)
+        return False
+
+    def run(self, time_limit):
+        """Greedy assignment, then local search for `time_limit` seconds.
+        Returns the best schedule found as an exam -> date dict."""
+        deadline = time.perf_counter() + time_limit
+        self.greedy()
+        # costs count each broken hard constraint as BREACH_COST
+        self.greedy_objective = self.objective(self.schedule)
+        best, best_objective = self.schedule.copy(), self.greedy_objective
+        self.iterations = 0
+
+        while time.perf_counter() < deadline and self.movable:
+            # work on exams that break constraints or violate ideal gaps
+            evaluation = self.evaluator.evaluate(self.schedule)
+            objective = int(evaluation.breaches[0]) * BREACH_COST + int(evaluation.objective[0])
+            if objective < best_objective:
+                best, best_objective = self.schedule.copy(), objective
+            if objective == 0: break
+            pairs = np.concatenate([self.evaluator.ideal_pairs[evaluation.ideal_violations[0]],
+                                    self.evaluator.min_pairs[evaluation.min_breaches[0]],
+                                    self.evaluator.before_pairs[evaluation.before_breaches[0]]])
+            over = np.flatnonzero(np.isin(self.schedule, np.flatnonzero(evaluation.over_capacity[0])))
+            conflicted = [i for i in set(pairs.ravel().tolist()) | set(over.tolist()) if i in self.movable_set]
+            if not conflicted:
+                conflicted = self.movable
+
+            for _ in range(100):
+                i = self.random.choice(conflicted)
+                if not self.move(i):
+                    self.swap(i)
+                self.iterations += 1
+
+        objective = self.objective(self.schedule)
+        if objective < best_objective:
+            best, best_objective = self.schedule.copy(), objective
+        self.schedule = best
+        self.best_objective = best_objective
+        return {i: int(t) for i, t in enumerate(best)}
+
+    def objective(self, schedule):
+        evaluation = self.evaluator.evaluate(schedule)
+        return int(evaluation.breaches[0]) * BREACH_COST + int(evaluation.objective[0])
+
+
+def heuristic_schedule(instance, time_limit, seed=0):
+    """Returns (schedule, breaches, objective, search) for a greedy and
+    local-search schedule of `instance`; `schedule` maps every exam to a date,
+    `breaches` counts the hard constraints it breaks."""
+    search = LocalSearch(instance, seed)
+    schedule = search.run(time_limit)
+    evaluation = search.evaluator.evaluate(search.schedule)
+    return schedule, int(evaluation.breaches[0]), int(evaluation.objective[0]), search
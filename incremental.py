@@ -0,0 +1,119 @@
+import csv
+from collections import deque
+
+#### Incremental re-solve ####
+# Compares the current instance with the one behind the last saved schedule
+# (exams are matched by name, dates by their label), and determines which
+# exams should be reopened; all other exams keep their previous date.
+
+def read_schedule_csv(fname, instance):
+    # exam -> date of a schedule written by `write_solution_to_csv`
+    exam_index = instance.exam_index
+    date_index = instance.date_index
+
+    schedule = {}
+    with open(fname, newline='') as f:
+        for row in csv.reader(f):
+            if len(row) < 2: continue
+            exam, date = row[0], row[1]
+            if exam in exam_index and date in date_index:
+                schedule[exam_index[exam]] = date_index[date]
+    return schedule
+
+
+def _named_pairs(instance, values):
+    names = instance.exam_names
+    return {(names[i], names[j]): v for (i, j), v in values.items()}
+
+
+def changed_exams(old, new, previous):
+    """Exams of `new` touched by a difference from `old`.
+
+    `previous` is the saved schedule (exam -> date, indexed as in `new`); it
+    determines which exams are affected by a change in a date's capacity."""
+    old_index = old.exam_index
+    new_names = new.exam_names
+    new_index = new.exam_index
+    changed = set()
+
+    # new exams or changed demands
+    for i, name in enumerate(new_names):
+        k = old_index.get(name)
+        if k is None or old.exam_demands[k] != new.exam_demands[i]:
+            changed.add(i)
+
+    # changed fixed dates
+    old_fixed = {old.exam_names[i]: old.dates[t] for i, t in old.exam_on_date.items()}
+    new_fixed = {new_names[i]: new.dates[t] for i, t in new.exam_on_date.items()}
+    for name in old_fixed.keys() | new_fixed.keys():
+        if old_fixed.get(name) != new_fixed.get(name) and name in new_index:
+            changed.add(new_index[name])
+
+    # changed pairwise constraints
+    def diff(old_values, new_values):
+        for (name1, name2) in old_values.keys() | new_values.keys():
+            if old_values.get((name1, name2)) != new_values.get((name1, name2)):
+                changed.update(new_index[name] for name in (name1, name2) if name in new_index)
+
+    diff(_named_pairs(old, old.min_days_between_exams), _named_pairs(new, new.min_days_between_exams))
+    diff(_named_pairs(old, {pair: (days, old.weights.get(pair)) for pair, days in old.ideal_days_between_exams.items()}),
+         _named_pairs(new, {pair: (days, new.weights.get(pair)) for pair, days in new.ideal_days_between_exams.items()}))
+    diff(_named_pairs(old, dict.fromkeys(old.exam_before_exam, True)),
+         _named_pairs(new, dict.fromkeys(new.exam_before_exam, True)))
+
+    # exams previously scheduled on a date whose capacity changed
+    old_capacity = dict(zip(old.dates, old.dates_capacity))
+    changed_dates = {t for t, date in enumerate(new.dates)
+                     if old_capacity.get(date) != new.dates_capacity[t]}
+    changed.update(i for i, t in previous.items() if t in changed_dates)
+
+    return changed
+
+
+def constraint_neighbors(instance):
+    neighbors = [set() for _ in range(instance.num_exams)]
+    pairs = list(instance.min_days_between_exams) + list(instance.ideal_days_between_exams) + list(instance.exam_before_exam)
+    for i, j in pairs:
+        neighbors[i].add(j)
+        neighbors[j].add(i)
+    return neighbors
+
+
+def expand_neighborhood(instance, exams, radius):
+    # all exams within `radius` constraint edges of `exams`
+    neighbors = constraint_neighbors(instance)
+    distance = {i: 0 for i in exams}
+    queue = deque(exams)
+    while queue:
+        i = queue.popleft()
+        if distance[i] == radius: continue
+        for j in neighbors[i]:
+            if j not in distance:
+                distance[j] = distance[i] + 1
+                queue.append(j)
+    return set(distance)
+
+
+def reopened_exams(old, new, previous, radius=1):
+    """Returns (reopened, changed): exams to solve for, and the subset directly
+    touched by changes. Exams with no previous date are always reopened."""
+    changed = changed_exams(old, new, previous)
+    changed.update(i for i in range(new.num_exams) if i not in previous and i not in new.exam_on_date)
+    # fixed exams never need reopening, but their neighbors may
+    reopened = expand_neighborhood(new, changed, radius) - set(new.exam_on_date)
+    return reopened, changed
+
+
+def restrict_model(model, exams, previous, reopened, mode='fix'):
+    """Returns a copy of `model` in which every exam outside `reopened` is
+    fixed at its previous date (mode 'fix'), and all other exams with a
+    previous date are hinted to it."""
+    model = model.Clone()
+    for i, var in enumerate(exams):
+        if isinstance(var, int) or i not in previous: continue
+        var = model.GetIntVarFromProtoIndex(var.Index())
+        if mode == 'fix' and i not in reopened:
+            model.Add(var == previous[i])
+        else:
+            model.AddHint(var, previous[i])
+    return model
@@ -0,0 +1,308 @@
+import numpy as np
+from dataclasses import dataclass, field
+from patterns import preprocess_name, preprocess_pattern, NameMatcher
+from precedence import PrecedenceGraph
+from metrics import Metrics
+
+#### Scheduling instance ####
+# Exams and dates are referred to by their position in `exam_names`/`dates`.
+
+@dataclass
+class Instance:
+    exam_names: list
+    exam_demands: list
+    dates: list
+    dates_capacity: list
+    # exam -> date
+    exam_on_date: dict = field(default_factory=dict)
+    # (exam1, exam2) -> days, with exam1 < exam2
+    min_days_between_exams: dict = field(default_factory=dict)
+    ideal_days_between_exams: dict = field(default_factory=dict)
+    weights: dict = field(default_factory=dict)
+    # (exam1, exam2) pairs, exam1 not later than exam2
+    exam_before_exam: list = field(default_factory=list)
+    # exam -> date, from a previous solution
+    hints: dict = field(default_factory=dict)
+    # (exam1, exam2) -> requested ideal days, for ideal gaps disabled (0 in
+    # ideal_days_between_exams) as within the minimal gap
+    disabled_ideal_days: dict = field(default_factory=dict)
+    # sheet row (1-based) behind each constraint: ('capacity', date),
+    # ('fix', exam), ('min', pair), ('ideal', pair) and ('before', pair) ->
+    # row; not saved in snapshots
+    rows: dict = field(default_factory=dict)
+
+    @property
+    def num_exams(self):
+        return len(self.exam_names)
+
+    @property
+    def horizon(self):
+        return len(self.dates)
+
+    @property
+    def exam_index(self):
+        return {name: i for i, name in enumerate(self.exam_names)}
+
+    @property
+    def date_index(self):
+        return {date: t for t, date in enumerate(self.dates)}
+
+
+# Sheets holding the instance (the previous solution is in 'שיבוץ')
+INPUT_SHEETS = ['בחינות', 'תאריכים', 'קיבועים', 'מרווחים', 'קדימויות']
+
+def parse_instance(sheets, log, log_duplicates=False, metrics=None):
+    """Parses the rows of the input sheets, as returned by `read_sheets`.
+
+    The pattern expansion of each constraint row is timed in `metrics`."""
+    metrics = metrics or Metrics()
+
+    # Extract exams
+    sheet_name = 'בחינות'
+    data_rows = sheets[sheet_name][2:]
+
+    exam_names = []
+    exam_demands = []
+    exam_index = {}
+    for row_i, row in enumerate(data_rows):
+        name, demand = row[1].strip(), row[2].strip()
+        name = preprocess_name(name)
+        if name:
+            if name in exam_index:
+                log(f'Name clash in {sheet_name}, row {row_i+3}')
+
+            exam_index[name] = len(exam_names)
+            demand = int(demand)
+            exam_names.append(name)
+            exam_demands.append(demand)
+
+    # Extract dates
+    sheet_name = 'תאריכים'
+    data_rows = sheets[sheet_name][2:]
+
+    dates = []
+    dates_capacity = []
+    date_index = {}
+    rows = {}
+    for row_i, row in enumerate(data_rows):
+        date, capacity = row[1].strip(), row[2].strip()
+        if date:
+            capacity = int(capacity) if capacity else 0
+            rows[('capacity', len(dates))] = row_i+3
+            date_index[date] = len(dates)
+            dates.append(date)
+            dates_capacity.append(capacity)
+
+
+    # Extract prescheduled constraints
+    sheet_name = 'קיבועים'
+    data_rows = sheets[sheet_name][2:]
+
+    exam_on_date = {}
+    for row_i, row in enumerate(data_rows):
+        name, date = row[1].strip(), row[2].strip()
+        if not (name and date): continue
+
+        date = date_index.get(date)
+        if not date:
+            log(f'Invalid date in {sheet_name}, row {row_i+3}')
+            continue
+
+        name = preprocess_name(name)
+        if name:
+            if name not in exam_index:  
+                # allow defining new events in this table
+                exam_index[name] = len(exam_names)
+                exam_names.append(name)
+                # events defined here should have zero demand
+                exam_demands.append(0)
+
+            exam = exam_index.get(name)
+            exam_on_date[exam] = date
+            rows[('fix', exam)] = row_i+3
+
+
+    # Index exam names for pattern expansion (the set of exams is final from here on)
+    matcher = NameMatcher(exam_names, exam_index)
+
+    # Extract minimal and ideal gap constraints
+    sheet_name = 'מרווחים'
+    data_rows = sheets[sheet_name][2:]
+
+    min_days_between_exams = {}
+    ideal_days_between_exams = {}
+    weights = {}
+    for row_i, row in enumerate(data_rows):
+        pattern1, pattern2, min_days, ideal_days, weight = row[1].strip(), row[2].strip(), row[3].strip(), row[4].strip(), row[5].strip()
+        if not (pattern1 and pattern2): continue
+
+        with metrics.span('expand', sheet=sheet_name, row=row_i+3) as labels:
+            pattern1 = preprocess_pattern(pattern1)
+            pattern2 = preprocess_pattern(pattern2)
+            pairs = matcher.matching_pairs(pattern1,pattern2)
+            labels['pairs'] = len(pairs)
+        if len(pairs) == 0:
+            log(f'Constraint in sheet {sheet_name}, row {row_i+3} yielded 0 matches')
+
+        min_days = int(min_days) if min_days else None
+        ideal_days = int(ideal_days) if ideal_days else None
+        weight = int(weight) if weight else 1
+
+        duplicates_found = False
+        overriding = False
+        for (exam1,exam2) in pairs:
+            # ensure that exam1 < exam2 to avoid duplicates
+            if exam1 == exam2: continue
+            if exam1 > exam2: (exam1, exam2) = (exam2, exam1)
+            pair = (exam1,exam2)
+
+            # detect duplicates/overrides
+            if pair in min_days_between_exams:
+                duplicates_found = True
+                if min_days and min_days != min_days_between_exams[pair]:
+                    overriding = True
+                min_days_between_exams.pop(pair, None)
+                rows.pop(('min', pair), None)
+
+            if pair in ideal_days_between_exams:
+                duplicates_found = True
+                if min_days and min_days != ideal_days_between_exams[pair]:
+                    overriding = True
+                ideal_days_between_exams.pop(pair, None)
+                weights.pop(pair, None)
+                rows.pop(('ideal', pair), None)
+
+            # update values
+            if min_days:
+                min_days_between_exams[pair] = min_days
+                rows[('min', pair)] = row_i+3
+            if ideal_days:
+                ideal_days_between_exams[pair] = ideal_days
+                weights[pair] = weight
+                rows[('ideal', pair)] = row_i+3
+
+        if log_duplicates and duplicates_found:
+            if overriding:
+                log(f'Duplicate constraint(s) detected in {sheet_name}, row {row_i+3} (OVERRIDING)')
+            else:
+                log(f'Duplicate constraint(s) detected in {sheet_name}, row {row_i+3} (non-overriding)')
+
+    # Filter out redundant constraints
+    disabled_ideal_days = {}
+    for (pair, min_days) in min_days_between_exams.items():
+        ideal_days = ideal_days_between_exams.get(pair)
+        if ideal_days and ideal_days <= min_days: 
+            # disable constraint
+            ideal_days_between_exams[pair] = 0
+            disabled_ideal_days[pair] = ideal_days
+
+    # Extract precedence constraints
+    sheet_name = 'קדימויות'
+    data_rows = sheets[sheet_name][2:]
+
+    precedences = PrecedenceGraph()
+    for row_i, row in enumerate(data_rows):
+        pattern1, pattern2 = row[1].strip(), row[2].strip()
+        if not (pattern1 and pattern2): continue
+
+        with metrics.span('expand', sheet=sheet_name, row=row_i+3) as labels:
+            pattern1 = preprocess_pattern(pattern1)
+            pattern2 = preprocess_pattern(pattern2)
+            pairs = matcher.matching_pairs(pattern1,pattern2)
+            labels['pairs'] = len(pairs)
+        if len(pairs) == 0:
+            log(f'Constraint in sheet {sheet_name}, row {row_i+3} yielded 0 matches')
+
+        duplicates_found = False
+        for (exam1, exam2) in pairs:
+            # detect duplicates
+            if precedences.add(exam1, exam2):
+                duplicates_found = True
+            rows[('before', (exam1, exam2))] = row_i+3
+
+        if log_duplicates and duplicates_found:
+            log(f'Duplicate constraint(s) detected in {sheet_name}, row {row_i+3}')
+
+    # Report cycles, which force all their exams onto the same date
+    for cycle in precedences.cycles():
+        log(f'Precedence cycle in {sheet_name} (forces a single date): ' + ', '.join(exam_names[i] for i in cycle))
+    exam_before_exam = list(precedences)
+
+    instance = Instance(exam_names, exam_demands, dates, dates_capacity,
+                        exam_on_date=exam_on_date,
+                        min_days_between_exams=min_days_between_exams,
+                        ideal_days_between_exams=ideal_days_between_exams,
+                        weights=weights,
+                        exam_before_exam=exam_before_exam,
+                        disabled_ideal_days=disabled_ideal_days,
+                        rows=rows)
+
+    # Read hints from existing solution, if the sheet was fetched (warm start)
+    if 'שיבוץ' in sheets:
+        instance.hints = parse_hints(sheets['שיבוץ'], instance)
+    return instance
+
+
+def parse_hints(rows, instance):
+    """Reads exam dates of an existing solution from the rows of 'שיבוץ'."""
+    exam_index = instance.exam_index
+    date_index = instance.date_index
+
+    hints = {}
+    data_rows = rows[3:]
+    for row_i, row in enumerate(data_rows):
+        exam, date = row[1].strip(), row[2].strip()
+        if not exam or not date or not (exam in exam_index) or not (date in date_index): continue
+
+        exam_i = exam_index[exam]
+        date_i = date_index[date]
+        hints[exam_i] = date_i
+    return hints
+
+
+#### Binary snapshots ####
+# A snapshot is a compressed .npz archive holding one array per instance
+# component; dict-valued components are stored as integer tables, in
+# insertion order.
+SNAPSHOT_VERSION = 1
+
+def _table(rows, width):
+    return np.array(rows, dtype=np.int64).reshape(-1, width)
+
+def save_snapshot(fname, instance):
+    # np.savez appends '.npz' to names without it, so open the file ourselves
+    with open(fname, 'wb') as f:
+        np.savez_compressed(f,
+            version=np.array(SNAPSHOT_VERSION),
+            exam_names=np.array(instance.exam_names, dtype=str),
+            exam_demands=np.array(instance.exam_demands, dtype=np.int64),
+            dates=np.array(instance.dates, dtype=str),
+            dates_capacity=np.array(instance.dates_capacity, dtype=np.int64),
+            exam_on_date=_table(list(instance.exam_on_date.items()), 2),
+            min_days=_table([(i, j, d) for (i, j), d in instance.min_days_between_exams.items()], 3),
+            ideal_days=_table([(i, j, d) for (i, j), d in instance.ideal_days_between_exams.items()], 3),
+            weights=_table([(i, j, w) for (i, j), w in instance.weights.items()], 3),
+            exam_before_exam=_table(instance.exam_before_exam, 2),
+            hints=_table(list(instance.hints.items()), 2),
+            disabled_ideal_days=_table([(i, j, d) for (i, j), d in instance.disabled_ideal_days.items()], 3))
+
+def load_snapshot(fname):
+    with np.load(fname, allow_pickle=False) as data:
+        version = int(data['version'])
+        if version != SNAPSHOT_VERSION:
+            raise ValueError(f'Unsupported snapshot version {version} in {fname} (expected {SNAPSHOT_VERSION})')
+
+        pairs = lambda key: {(int(i), int(j)): int(v) for i, j, v in data[key]}
+        items = lambda key: {int(k): int(v) for k, v in data[key]}
+        return Instance(data['exam_names'].tolist(),
+                        data['exam_demands'].tolist(),
+                        data['dates'].tolist(),
+                        data['dates_capacity'].tolist(),
+                        exam_on_date=items('exam_on_date'),
+                        min_days_between_exams=pairs('min_days'),
+                        ideal_days_between_exams=pairs('ideal_days'),
+                        weights=pairs('weights'),
+                        exam_before_exam=[(int(i), int(j)) for i, j in data['exam_before_exam']],
+                        hints=items('hints'),
+                        # (absent from older snapshots)
+                        disabled_ideal_days=pairs('disabled_ideal_days') if 'disabled_ideal_days' in data else {})
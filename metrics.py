@@ -0,0 +1,104 @@
+import re
+import json
+import time
+from contextlib import contextmanager
+
+#### Run metrics ####
+# Timing spans of the phases of a run, and the solver's progress (objective
+# and best bound over time), written to a JSON or Prometheus text file.
+# Times are in seconds since the `Metrics` object was created.
+
+# CP-SAT log line marking the end of loading/presolve and the start of search
+_SEARCH_START = re.compile(r'^Starting (?:\w+ )?search at ([\d.]+)s')
+
+class Metrics:
+    def __init__(self):
+        self.start_time = time.perf_counter()
+        # dicts of name, start, duration and labels
+        self.spans = []
+        # (wall time, objective, best bound) of each solution
+        self.progress = []
+
+    def now(self):
+        return time.perf_counter() - self.start_time
+
+    @contextmanager
+    def span(self, name, **labels):
+        start = self.now()
+        try:
+            yield labels
+        finally:
+            self.spans.append({'name': name, 'start': start, 'duration': self.now() - start, 'labels': labels})
+
+    def add_span(self, name, start, duration, **labels):
+        self.spans.append({'name': name, 'start': start, 'duration': duration, 'labels': labels})
+
+    def record_solution(self, wall_time, objective, bound):
+        self.progress.append((wall_time, objective, bound))
+
+    def phase_totals(self):
+        # name -> (total duration, count)
+        totals = {}
+        for span in self.spans:
+            duration, count = totals.get(span['name'], (0.0, 0))
+            totals[span['name']] = (duration + span['duration'], count + 1)
+        return totals
+
+    def to_json(self):
+        return {
+            'phases': {name: {'seconds': d, 'count': c} for name, (d, c) in self.phase_totals().items()},
+            'spans': self.spans,
+            'progress': [{'wall_time': t, 'objective': o, 'bound': b} for t, o, b in self.progress],
+        }
+
+    def to_prometheus(self):
+        lines = ['# HELP scheduler_phase_seconds Time spent in each phase of the run.',
+                 '# TYPE scheduler_phase_seconds summary']
+        for name, (duration, count) in self.phase_totals().items():
+            lines.append(f'scheduler_phase_seconds_sum{{phase="{name}"}} {duration:.6f}')
+            lines.append(f'scheduler_phase_seconds_count{{phase="{name}"}} {count}')
+        lines += ['# HELP scheduler_solutions_total Solutions found by the solver.',
+                  '# TYPE scheduler_solutions_total counter',
+                  f'scheduler_solutions_total {len(self.progress)}']
+        if self.progress:
+            first, last = self.progress[0], self.progress[-1]
+            lines += ['# HELP scheduler_first_solution_seconds Solver wall time of the first solution.',
+                      '# TYPE scheduler_first_solution_seconds gauge',
+                      f'scheduler_first_solution_seconds {first[0]:.6f}',
+                      '# HELP scheduler_objective Objective value of the best solution.',
+                      '# TYPE scheduler_objective gauge',
+                      f'scheduler_objective {last[1]}',
+                      '# HELP scheduler_best_bound Best objective bound.',
+                      '# TYPE scheduler_best_bound gauge',
+                      f'scheduler_best_bound {last[2]}']
+        return '\n'.join(lines) + '\n'
+
+    def write(self, fname):
+        # JSON for '.json' files, Prometheus text format otherwise
+        with open(fname, 'w') as f:
+            if fname.endswith('.json'):
+                json.dump(self.to_json(), f, indent=2)
+            else:
+                f.write(self.to_prometheus())
+
+
+class SolverLogTimer:
+    """Solver log callback that records where presolve ends and search starts."""
+
+    def __init__(self, forward=None):
+        self.forward = forward
+        self.search_start = None
+
+    def __call__(self, line):
+        match = _SEARCH_START.match(line)
+        if match and self.search_start is None:
+            self.search_start = float(match.group(1))
+        if self.forward: self.forward(line)
+
+    def add_spans(self, metrics, solve_start, wall_time):
+        # presolve (including model loading) and search spans of a finished solve
+        if self.search_start is None:
+            metrics.add_span('presolve', solve_start, wall_time)
+            return
+        metrics.add_span('presolve', solve_start, self.search_start)
+        metrics.add_span('search', solve_start + self.search_start, wall_time - self.search_start)
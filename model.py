@@ -0,0 +1,572 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+import ortools
+from ortools.sat.python import cp_model
+from instance import save_snapshot, load_snapshot
+from precedence import PrecedenceGraph
+
+#### Model construction ####
+def clique_cover(edges):
+    """Greedily covers the edges of a graph by maximal cliques."""
+    adj = {}
+    for i, j in edges:
+        adj.setdefault(i, set()).add(j)
+        adj.setdefault(j, set()).add(i)
+    edge = lambda a, b: (a, b) if a < b else (b, a)
+    uncovered = {edge(i, j) for i, j in edges}
+
+    cliques = []
+    for i, j in edges:
+        if edge(i, j) not in uncovered: continue
+        clique = [i, j]
+        candidates = adj[i] & adj[j]
+        while candidates:
+            # prefer the vertex that covers the most new edges
+            k = max(candidates, key=lambda k: (sum(edge(k, m) in uncovered for m in clique), -k))
+            clique.append(k)
+            candidates &= adj[k]
+        for a in range(len(clique)):
+            for b in range(a+1, len(clique)):
+                uncovered.discard(edge(clique[a], clique[b]))
+        cliques.append(clique)
+    return cliques
+
+
+#### Domain tightening ####
+# Exams related by precedences are bounded by each other's dates: if exam i
+# is not later than exam j, then j is at least `min days` after i (the gap
+# between them, if any), and vice versa. Longest paths over the precedence
+# graph, starting from fixed dates and the horizon, give a window of dates
+# per exam; dates whose capacity is below an exam's demand are also excluded.
+
+def date_windows(instance):
+    """Returns (earliest, latest) date lists; earliest > latest for an exam
+    means that the precedences and fixed dates cannot be met."""
+    horizon = instance.horizon
+    capacity = instance.dates_capacity
+    earliest = [0] * instance.num_exams
+    latest = [horizon - 1] * instance.num_exams
+    for i, t in instance.exam_on_date.items():
+        earliest[i] = latest[i] = t
+
+    graph = PrecedenceGraph(instance.exam_before_exam)
+    components = graph.components()
+    component_of = {i: k for k, c in enumerate(components) for i in c}
+    # the exams of a precedence cycle share a date
+    lo = [max(earliest[i] for i in c) for c in components]
+    hi = [min(latest[i] for i in c) for c in components]
+    demand = [max(instance.exam_demands[i] for i in c) for c in components]
+
+    edges = {}
+    for i, j in graph:
+        ci, cj = component_of[i], component_of[j]
+        if ci == cj: continue
+        days = instance.min_days_between_exams.get((i, j) if i < j else (j, i), 0)
+        edges[(ci, cj)] = max(edges.get((ci, cj), 0), days)
+    out_edges = [[] for _ in components]
+    in_edges = [[] for _ in components]
+    for (ci, cj), days in edges.items():
+        out_edges[ci].append((cj, days))
+        in_edges[cj].append((ci, days))
+
+    # forward in topological order, moving past dates without enough capacity
+    for c in range(len(components)):
+        for ci, days in in_edges[c]:
+            lo[c] = max(lo[c], lo[ci] + days)
+        while lo[c] < horizon and capacity[lo[c]] < demand[c]:
+            lo[c] += 1
+    for c in reversed(range(len(components))):
+        for cj, days in out_edges[c]:
+            hi[c] = min(hi[c], hi[cj] - days)
+        while hi[c] >= 0 and capacity[hi[c]] < demand[c]:
+            hi[c] -= 1
+
+    for k, c in enumerate(components):
+        for i in c:
+            earliest[i], latest[i] = lo[k], hi[k]
+    return earliest, latest
+
+
+#### Symmetry breaking ####
+# Exams with the same demand, no fixed date and the same constraints with
+# every other exam (twins) can swap dates in any solution, so the search need
+# only consider one order of their dates. Twins either share no constraint
+# (equal neighborhoods) or share the same one (equal neighborhoods once each
+# includes itself), and are found by grouping exams on these signatures.
+
+def constraint_labels(instance):
+    # exam -> {other exam: labels of the constraints between them}
+    neighbors = [{} for _ in range(instance.num_exams)]
+    def add(i, j, label_ij, label_ji):
+        neighbors[i].setdefault(j, set()).add(label_ij)
+        neighbors[j].setdefault(i, set()).add(label_ji)
+    for (i, j), days in instance.min_days_between_exams.items():
+        if days < 1: continue
+        add(i, j, ('min', days), ('min', days))
+    for (i, j), days in instance.ideal_days_between_exams.items():
+        if days < 1: continue
+        label = ('ideal', days, instance.weights.get((i, j), 1))
+        add(i, j, label, label)
+    for i, j in instance.exam_before_exam:
+        if i == j: continue
+        add(i, j, 'before', 'after')
+    return [{j: frozenset(labels) for j, labels in n.items()} for n in neighbors]
+
+def symmetry_classes(instance):
+    """Classes of two or more interchangeable exams, each sorted by index."""
+    neighbors = constraint_labels(instance)
+    groups = {}
+    for i in range(instance.num_exams):
+        if i in instance.exam_on_date: continue
+        demand = instance.exam_demands[i]
+        signature = frozenset(neighbors[i].items())
+        groups.setdefault((demand, signature), []).append(i)
+        for labels in set(neighbors[i].values()):
+            groups.setdefault((demand, labels, signature | {(i, labels)}), []).append(i)
+
+    # (an exam belongs to at most one nontrivial class; keep it to the first)
+    classes = []
+    assigned = set()
+    for members in groups.values():
+        members = [i for i in members if i not in assigned]
+        if len(members) > 1:
+            classes.append(members)
+            assigned.update(members)
+    return classes
+
+def order_symmetric_values(classes, values):
+    # permutes the values (exam -> date) within each fully valued class into
+    # increasing order, which keeps them feasible under symmetry breaking
+    values = dict(values)
+    for members in classes:
+        if all(i in values for i in members):
+            for i, v in zip(members, sorted(values[i] for i in members)):
+                values[i] = v
+    return values
+
+
+#### Ideal gap encodings ####
+# Each encoding posts the soft constraints |exam_i - exam_j| >= days (for
+# dates in range(horizon)) and returns a violation literal per pair, which is
+# false only if the gap holds, and its auxiliary variables by kind (hinted by
+# warm_start.add_full_hints).
+
+def ideal_gaps_intervals(model, exams, ideal_days_between_exams, horizon):
+    # dedicated optional intervals for each pair of exams
+    ideal_violations = {}
+    for (i, j), days in ideal_days_between_exams.items():
+        # ignore disabled constraints
+        if days < 1: continue
+
+        ideal_violations.setdefault((i,j), model.NewBoolVar(f'violation_{i,j}'))
+
+        interval_i = model.NewOptionalFixedSizeIntervalVar(exams[i], days, ideal_violations[(i,j)].Not(), f'idealgap_{i,j}')
+        interval_j = model.NewOptionalFixedSizeIntervalVar(exams[j], days, ideal_violations[(i,j)].Not(), f'idealgap_{j,i}')
+        model.AddNoOverlap([interval_i, interval_j])
+    return ideal_violations, {}
+
+def ideal_gaps_linear(model, exams, ideal_days_between_exams, horizon):
+    # reified linear constraints, with a literal choosing the order of the pair
+    ideal_violations = {}
+    # (i, j) -> whether exam i comes first
+    before = {}
+    for (i, j), days in ideal_days_between_exams.items():
+        if days < 1: continue
+
+        violation = model.NewBoolVar(f'violation_{i,j}')
+        before[(i,j)] = model.NewBoolVar(f'before_{i,j}')
+        model.Add(exams[j] - exams[i] >= days).OnlyEnforceIf([violation.Not(), before[(i,j)]])
+        model.Add(exams[i] - exams[j] >= days).OnlyEnforceIf([violation.Not(), before[(i,j)].Not()])
+        ideal_violations[(i,j)] = violation
+    return ideal_violations, {'before': before}
+
+def ideal_gaps_shared(model, exams, ideal_days_between_exams, horizon):
+    # one optional interval per (exam, days), shared by all pairs of that
+    # length; a pair is satisfied only if both its intervals are present.
+    # This is a restriction: an exam that drops its interval violates all of
+    # its pairs of that length, so the optimum may be worse than the exact one.
+    presence = {}
+    intervals = {}
+    def interval(i, days):
+        if (i, days) not in intervals:
+            presence[(i, days)] = model.NewBoolVar(f'idealgap_present_{i,days}')
+            intervals[(i, days)] = model.NewOptionalFixedSizeIntervalVar(exams[i], days, presence[(i, days)], f'idealgap_{i,days}')
+        return intervals[(i, days)]
+
+    ideal_violations = {}
+    for (i, j), days in ideal_days_between_exams.items():
+        if days < 1: continue
+
+        violation = model.NewBoolVar(f'violation_{i,j}')
+        model.AddNoOverlap([interval(i, days), interval(j, days)])
+        model.AddImplication(violation.Not(), presence[(i, days)])
+        model.AddImplication(violation.Not(), presence[(j, days)])
+        ideal_violations[(i,j)] = violation
+    return ideal_violations, {'present': presence}
+
+def ideal_gaps_distance(model, exams, ideal_days_between_exams, horizon):
+    # a distance variable |exam_i - exam_j| per pair, bounded from below
+    ideal_violations = {}
+    distance = {}
+    for (i, j), days in ideal_days_between_exams.items():
+        if days < 1: continue
+
+        violation = model.NewBoolVar(f'violation_{i,j}')
+        distance[(i,j)] = model.NewIntVar(0, horizon-1, f'distance_{i,j}')
+        model.AddAbsEquality(distance[(i,j)], exams[i] - exams[j])
+        model.Add(distance[(i,j)] >= days).OnlyEnforceIf(violation.Not())
+        ideal_violations[(i,j)] = violation
+    return ideal_violations, {'distance': distance}
+
+IDEAL_GAP_ENCODINGS = {
+    'intervals': ideal_gaps_intervals,
+    'linear': ideal_gaps_linear,
+    'shared': ideal_gaps_shared,
+    'distance': ideal_gaps_distance,
+}
+
+
+#### Capacity encodings ####
+# Each encoding limits the total demand of the exams on each date to that
+# date's capacity, and returns its auxiliary variables by kind.
+
+def capacity_cumulative(model, exams, exam_demands, dates_capacity):
+    # one cumulative, padded with fake demand up to the largest capacity
+    num_exams, horizon = len(exams), len(dates_capacity)
+    max_capacity = max(dates_capacity)
+    exam_intervals = [model.NewFixedSizeIntervalVar(exams[i], 1, f'demand_{i}') for i in range(num_exams)]
+    fake_intervals = [model.NewFixedSizeIntervalVar(t, 1, f'fake_demand_{t}') for t in range(horizon)]
+    all_intervals = exam_intervals + fake_intervals
+    all_demands = exam_demands + [max_capacity - c for c in dates_capacity]
+    model.AddCumulative(all_intervals, all_demands, max_capacity)
+    return {}
+
+def capacity_clamped_cumulative(model, exams, exam_demands, dates_capacity):
+    # as above, but each capacity is first clamped to the largest demand that
+    # could ever land on its date, so a single huge capacity does not inflate
+    # the padding of every other date; zero demands and paddings are omitted
+    free_demand = sum(d for var, d in zip(exams, exam_demands) if not isinstance(var, int))
+    fixed_demand = [0] * len(dates_capacity)
+    for var, d in zip(exams, exam_demands):
+        if isinstance(var, int): fixed_demand[var] += d
+    capacity = [min(c, free_demand + fixed_demand[t]) for t, c in enumerate(dates_capacity)]
+    max_capacity = max(capacity)
+
+    intervals, demands = [], []
+    for i, (var, d) in enumerate(zip(exams, exam_demands)):
+        if d == 0: continue
+        intervals.append(model.NewFixedSizeIntervalVar(var, 1, f'demand_{i}'))
+        demands.append(d)
+    for t, c in enumerate(capacity):
+        if c == max_capacity: continue
+        intervals.append(model.NewFixedSizeIntervalVar(t, 1, f'fake_demand_{t}'))
+        demands.append(max_capacity - c)
+    model.AddCumulative(intervals, demands, max_capacity)
+    return {}
+
+def domain_values(var):
+    # the values in an integer variable's domain
+    domain = var.Proto().domain
+    return [t for lo, hi in zip(domain[::2], domain[1::2]) for t in range(lo, hi+1)]
+
+def capacity_assignment(model, exams, exam_demands, dates_capacity):
+    # a Boolean per (exam, date), with a linear capacity sum per date
+    remaining = list(dates_capacity)
+    for var, d in zip(exams, exam_demands):
+        if isinstance(var, int): remaining[var] -= d
+
+    load = [[] for _ in dates_capacity]
+    # (i, t) -> whether exam i is on date t
+    assigned = {}
+    for i, (var, d) in enumerate(zip(exams, exam_demands)):
+        if isinstance(var, int) or d == 0: continue
+        on_date = {}
+        for t in domain_values(var):
+            if t < len(dates_capacity) and d <= remaining[t]:
+                on_date[t] = assigned[(i,t)] = model.NewBoolVar(f'on_date_{i,t}')
+                load[t].append((on_date[t], d))
+        model.AddExactlyOne(on_date.values())
+        model.Add(var == sum(t * b for t, b in on_date.items()))
+
+    for t, terms in enumerate(load):
+        # (a date overloaded by fixed exams alone yields a trivially false constraint)
+        if sum(d for _, d in terms) > remaining[t]:
+            model.Add(sum(d * b for b, d in terms) <= remaining[t])
+    return {'on_date': assigned}
+
+CAPACITY_ENCODINGS = {
+    'cumulative': capacity_cumulative,
+    'clamped_cumulative': capacity_clamped_cumulative,
+    'assignment': capacity_assignment,
+}
+
+
+def build_model(instance, options=None, log=None):
+    """Builds the CP-SAT model for an instance.
+
+    Returns the model, the per-exam date variables (plain ints for exams with
+    a fixed date), the ideal-gap violation literals by exam pair and the
+    auxiliary variables of the chosen encodings, as {kind: {key: var}}."""
+    options = options or {}
+    exam_demands = instance.exam_demands
+    dates_capacity = instance.dates_capacity
+    exam_on_date = instance.exam_on_date
+    min_days_between_exams = instance.min_days_between_exams
+    ideal_days_between_exams = instance.ideal_days_between_exams
+    weights = instance.weights
+    exam_before_exam = instance.exam_before_exam
+
+    # Define the number of exams and the number of days
+    num_exams = instance.num_exams
+    horizon = instance.horizon
+
+    # Create a CP-SAT model
+    model = cp_model.CpModel()
+
+    # Create variables
+    # exams = [model.NewIntVar(0, horizon-1, f'exam_{i}') for i in range(num_exams)]
+    exams = [None] * num_exams
+    for (exam_i,date_i) in exam_on_date.items():
+        exams[exam_i] = date_i
+    if options.get('tighten_domains', True):
+        # only dates within reach of the precedences, with enough capacity
+        earliest, latest = date_windows(instance)
+        num_values = 0
+        for date_i in range(num_exams):
+            if exams[date_i] is not None: continue
+            values = [t for t in range(earliest[date_i], latest[date_i]+1) if dates_capacity[t] >= exam_demands[date_i]]
+            if not values:
+                # an empty domain would make the model invalid; keep all dates
+                # and post an empty clause, so the status is INFEASIBLE
+                if log:
+                    log(f'No feasible date for {instance.exam_names[date_i]} (precedences, fixed dates or capacities)')
+                model.AddBoolOr([])
+                values = range(horizon)
+            exams[date_i] = model.NewIntVarFromDomain(cp_model.Domain.FromValues(values), f'exam_{date_i}')
+            num_values += len(values)
+        num_free = num_exams - len(exam_on_date)
+        if log and num_free:
+            log(f'Tightened domains to {num_values / num_free:.1f} of {horizon} dates per exam on average')
+    for date_i in range(num_exams):
+        if exams[date_i] is not None: continue
+        exams[date_i] = model.NewIntVar(0, horizon-1, f'exam_{date_i}')
+
+    # Create intervals for each (exam,days) pair
+    gap_intervals = {}
+    for (i, j), days in min_days_between_exams.items():
+        # ignore disabled constraints
+        if days < 1: continue
+        gap_intervals.setdefault((i,days), model.NewFixedSizeIntervalVar(exams[i], days, f'mingap_{i,days}'))
+        gap_intervals.setdefault((j,days), model.NewFixedSizeIntervalVar(exams[j], days, f'mingap_{j,days}'))
+
+    # Add minimal gap constraints
+    if options.get('min_gap_cliques', True):
+        # one no-overlap per clique of exams with pairwise equal gaps
+        pairs_by_days = {}
+        for (i, j), days in min_days_between_exams.items():
+            # ignore disabled constraints
+            if days < 1: continue
+            pairs_by_days.setdefault(days, []).append((i, j))
+
+        num_pairs = num_cliques = 0
+        for days, pairs in pairs_by_days.items():
+            for clique in clique_cover(pairs):
+                model.AddNoOverlap([gap_intervals[(k,days)] for k in clique])
+                num_cliques += 1
+            num_pairs += len(pairs)
+        if log:
+            log(f'Posted {num_pairs} minimal gap pairs as {num_cliques} no-overlap constraints')
+    else:
+        for (i, j), days in min_days_between_exams.items():
+            # ignore disabled constraints
+            if days < 1: continue
+            # Interval for each exam
+            interval_i = gap_intervals[(i,days)]
+            interval_j = gap_intervals[(j,days)]
+            model.AddNoOverlap([interval_i, interval_j])
+
+    # Add ideal gap constraints
+    encoding = options.get('ideal_gap_encoding', 'intervals')
+    if encoding not in IDEAL_GAP_ENCODINGS:
+        raise ValueError(f'Unknown ideal gap encoding: {encoding}')
+    ideal_violations, auxiliary = IDEAL_GAP_ENCODINGS[encoding](model, exams, ideal_days_between_exams, horizon)
+
+    # Add daily capacity constraints
+    encoding = options.get('capacity_encoding', 'cumulative')
+    if encoding not in CAPACITY_ENCODINGS:
+        raise ValueError(f'Unknown capacity encoding: {encoding}')
+    auxiliary.update(CAPACITY_ENCODINGS[encoding](model, exams, exam_demands, dates_capacity))
+
+    # Add precedence constraints (omitting those implied by others)
+    for (i,j) in PrecedenceGraph(exam_before_exam).reduced():
+        model.Add(exams[i] <= exams[j])
+
+    # Order interchangeable exams (by index)
+    if options.get('symmetry_breaking', True):
+        classes = symmetry_classes(instance)
+        for members in classes:
+            for a, b in zip(members, members[1:]):
+                # twins sharing a minimal gap are that far apart
+                model.Add(exams[b] >= exams[a] + min_days_between_exams.get((a,b), 0))
+        if log:
+            log(f'Found {len(classes)} symmetry classes ({sum(len(c) for c in classes)} exams), '
+                f'posted {sum(len(c) - 1 for c in classes)} ordering constraints')
+
+    # Define the objective
+
+    # Minimize soft constraints violation
+    # model.Minimize( sum(ideal_violations.values()) )
+
+    # Minimize soft constraints weighted violation
+    keys = ideal_violations.keys()
+    expr = [ideal_violations[k] for k in keys]
+    coef = [weights[k] for k in keys]
+    model.Minimize(cp_model.LinearExpr.WeightedSum(expr,coef))
+
+    # # Define the objective: makespan
+    # makespan = model.NewIntVar(0, horizon, 'makespan')
+    # model.AddMaxEquality(makespan, exams)
+    # model.Minimize(makespan)
+
+    return model, exams, ideal_violations, auxiliary
+
+
+#### Solve helpers ####
+class FirstSolutionTimer(cp_model.CpSolverSolutionCallback):
+    def __init__(self):
+        cp_model.CpSolverSolutionCallback.__init__(self)
+        self.first_solution_time = None
+
+    def on_solution_callback(self):
+        if self.first_solution_time is None:
+            self.first_solution_time = self.WallTime()
+
+def weighted_violations(instance, values):
+    # objective of an assignment, from the actual gaps between exams
+    total = 0
+    for (i, j), days in instance.ideal_days_between_exams.items():
+        if days > 0 and abs(values[i] - values[j]) < days:
+            total += instance.weights[(i, j)]
+    return total
+
+def build_options_from_params(params):
+    # model build options (part of the model cache key)
+    return {
+        'min_gap_cliques': params.get('min_gap_cliques', True),
+        'ideal_gap_encoding': params.get('ideal_gap_encoding', 'intervals'),
+        'capacity_encoding': params.get('capacity_encoding', 'cumulative'),
+        'symmetry_breaking': params.get('symmetry_breaking', True),
+        'tighten_domains': params.get('tighten_domains', True),
+    }
+
+
+#### Model cache ####
+# Built models are cached on disk under a key derived from the model inputs
+# (raw sheet values or instance contents), the build options and the ortools
+# version. An entry holds the instance snapshot (without hints), the
+# serialized model proto, the proto indices of the exam, violation and
+# auxiliary variables and the lines logged while parsing and building (replayed on a
+# hit). Only the `max_entries` most recently used entries are kept.
+
+# bump whenever build_model output (or the entry format) changes, so that
+# entries built by older code are not served
+MODEL_CACHE_VERSION = 5
+
+def instance_fingerprint(instance):
+    # everything the model depends on, in a JSON-serializable form (no hints)
+    return [instance.exam_names, instance.exam_demands,
+            instance.dates, instance.dates_capacity,
+            list(instance.exam_on_date.items()),
+            list(instance.min_days_between_exams.items()),
+            list(instance.ideal_days_between_exams.items()),
+            list(instance.weights.items()),
+            list(instance.exam_before_exam)]
+
+def model_cache_key(inputs, options=None):
+    h = hashlib.sha256()
+    h.update(f'{MODEL_CACHE_VERSION};{ortools.__version__};'.encode())
+    h.update(json.dumps(options or {}, sort_keys=True).encode())
+    h.update(json.dumps(inputs, sort_keys=True, ensure_ascii=False).encode())
+    return h.hexdigest()
+
+
+class ModelCache:
+    def __init__(self, cache_dir, max_entries=20):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+
+    def _entry(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def load(self, key):
+        """Returns (instance, model, exams, ideal_violations, auxiliary,
+        log_lines), or None on a miss."""
+        entry = self._entry(key)
+        if not os.path.isdir(entry): return None
+        # mark the entry as recently used
+        os.utime(entry)
+
+        instance = load_snapshot(os.path.join(entry, 'instance.npz'))
+        model = cp_model.CpModel()
+        with open(os.path.join(entry, 'model.pb'), 'rb') as f:
+            model.Proto().ParseFromString(f.read())
+
+        with np.load(os.path.join(entry, 'vars.npz'), allow_pickle=False) as data:
+            exams = [instance.exam_on_date[i] if index < 0 else model.GetIntVarFromProtoIndex(int(index))
+                     for i, index in enumerate(data['exams'])]
+            ideal_violations = {(int(i), int(j)): model.GetBoolVarFromProtoIndex(int(index))
+                                for i, j, index in data['ideal_violations']}
+            auxiliary = {name[len('auxiliary_'):]: {(int(a), int(b)): model.GetIntVarFromProtoIndex(int(index))
+                                                    for a, b, index in data[name]}
+                         for name in data.files if name.startswith('auxiliary_')}
+
+        with open(os.path.join(entry, 'log.json'), encoding='utf-8') as f:
+            log_lines = json.load(f)
+
+        return instance, model, exams, ideal_violations, auxiliary, log_lines
+
+    def store(self, key, instance, model, exams, ideal_violations, auxiliary, log_lines=()):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # write into a temporary directory, then move it into place
+        tmp_dir = tempfile.mkdtemp(dir=self.cache_dir, prefix='.tmp-')
+        try:
+            hints, instance.hints = instance.hints, {}
+            try:
+                save_snapshot(os.path.join(tmp_dir, 'instance.npz'), instance)
+            finally:
+                instance.hints = hints
+
+            with open(os.path.join(tmp_dir, 'model.pb'), 'wb') as f:
+                f.write(model.Proto().SerializeToString())
+
+            exam_indices = [-1 if isinstance(var, int) else var.Index() for var in exams]
+            violation_indices = [(i, j, var.Index()) for (i, j), var in ideal_violations.items()]
+            auxiliary_indices = {f'auxiliary_{kind}': np.array([(a, b, var.Index()) for (a, b), var in variables.items()],
+                                                               dtype=np.int64).reshape(-1, 3)
+                                 for kind, variables in auxiliary.items()}
+            with open(os.path.join(tmp_dir, 'vars.npz'), 'wb') as f:
+                np.savez(f,
+                    exams=np.array(exam_indices, dtype=np.int64),
+                    ideal_violations=np.array(violation_indices, dtype=np.int64).reshape(-1, 3),
+                    **auxiliary_indices)
+
+            with open(os.path.join(tmp_dir, 'log.json'), 'w', encoding='utf-8') as f:
+                json.dump(list(log_lines), f, ensure_ascii=False)
+
+            os.rename(tmp_dir, self._entry(key))
+        except OSError:
+            # e.g. another run stored the same entry concurrently
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        self.evict()
+
+    def evict(self):
+        # drop the least recently used entries beyond `max_entries`
+        entries = [entry for entry in os.scandir(self.cache_dir)
+                   if entry.is_dir() and not entry.name.startswith('.')]
+        entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+        for entry in entries[max(0, self.max_entries):]:
+            shutil.rmtree(entry.path, ignore_errors=True)
@@ -0,0 +1,95 @@
+import re
+import bisect
+from functools import lru_cache
+
+#### pattern helper functions ####
+def preprocess_name(name):
+    # strip consecutive whitespaces
+    name = re.sub(' +', ' ', name)
+    return name
+
+def preprocess_pattern(pattern):
+    # strip consecutive whitespaces
+    pattern = re.sub(' +', ' ', pattern)
+    # use '#' as a wildcard character (in addition to '.')
+    pattern = pattern.replace('#', '.')
+    return pattern
+
+@lru_cache(maxsize=None)
+def compile_pattern(pattern):
+    return re.compile(pattern)
+
+_META = set('.^$*+?{}[]()|\\')
+_QUANTIFIERS = set('*+?{')
+
+@lru_cache(maxsize=None)
+def literal_prefix(pattern):
+    """Returns (prefix, is_literal): a string every full match must start with,
+    and whether the pattern matches exactly that string and nothing else."""
+    # alternation may discard the prefix, so be conservative
+    if '|' in pattern:
+        return '', False
+    for k, c in enumerate(pattern):
+        if c in _META:
+            # a quantifier applies to the preceding literal character
+            end = k-1 if c in _QUANTIFIERS else k
+            return pattern[:max(end, 0)], False
+    return pattern, True
+
+
+class NameMatcher:
+    """Expands name patterns against a fixed list of names.
+
+    Candidates are narrowed with a sorted index on the literal prefix of each
+    pattern before any regex is evaluated, so the cost of a lookup grows with
+    the number of names sharing that prefix rather than with all names.
+    Results are identical to scanning `names` with `re.fullmatch`."""
+
+    def __init__(self, names, index):
+        self.names = names
+        self.index = index
+        # positions of every name (names may repeat), for exact lookups
+        self.positions = {}
+        for pos, name in enumerate(names):
+            self.positions.setdefault(name, []).append(pos)
+        # names sorted lexicographically, for prefix range lookups
+        self.sorted_names = sorted(self.positions)
+
+    def _candidates(self, pattern):
+        # positions of names that may fully match pattern, in input order
+        prefix, is_literal = literal_prefix(pattern)
+        if is_literal:
+            return self.positions.get(pattern, [])
+        if not prefix:
+            return range(len(self.names))
+
+        lo = bisect.bisect_left(self.sorted_names, prefix)
+        hi = lo
+        while hi < len(self.sorted_names) and self.sorted_names[hi].startswith(prefix):
+            hi += 1
+        positions = [pos for name in self.sorted_names[lo:hi] for pos in self.positions[name]]
+        return sorted(positions)
+
+    def matching(self, pattern):
+        prefix, is_literal = literal_prefix(pattern)
+        if is_literal:
+            if pattern not in self.positions: return []
+            return [self.index[pattern]] * len(self.positions[pattern])
+
+        fullmatch = compile_pattern(pattern).fullmatch
+        names = self.names
+        return [self.index[names[pos]] for pos in self._candidates(pattern) if fullmatch(names[pos])]
+
+    def matching_pairs(self, pattern1, pattern2):
+        matches = self.matching(pattern1)
+        sub = compile_pattern(pattern1).sub
+        subs = [sub(pattern2, self.names[i]) for i in matches]
+
+        # expand each distinct substituted pattern only once
+        expanded = {s: self.matching(s) for s in set(subs)}
+
+        pairs = []
+        for i1,s in zip(matches,subs):
+            for i2 in expanded[s]:
+                if i1 != i2: pairs.append((i1,i2))
+        return pairs
@@ -0,0 +1,107 @@
+import os
+import time
+import tempfile
+import threading
+import numpy as np
+from contextlib import contextmanager
+
+#### Solution persistence ####
+# Saving incumbents off the solver thread: the solution callback only copies
+# the solution vector and hands it to a background writer, which writes the
+# latest one at most once per interval.
+
+# the umask can only be read by setting it, so read it once at import
+# (rather than while writer threads may create files)
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+def _file_mode(fname):
+    try:
+        return os.stat(fname).st_mode & 0o7777
+    except FileNotFoundError:
+        return 0o666 & ~_UMASK
+
+
+@contextmanager
+def atomic_write(fname, mode='w', **kwargs):
+    """Opens a temporary file next to `fname`, renamed over it on success,
+    so that readers never see a partially written file."""
+    dirname = os.path.dirname(os.path.abspath(fname))
+    fd, tmp_name = tempfile.mkstemp(dir=dirname, prefix='.' + os.path.basename(fname) + '.')
+    try:
+        with os.fdopen(fd, mode, **kwargs) as f:
+            yield f
+        # mkstemp creates the file owner-only: keep the mode of the file
+        # replaced, or that of a new file under the umask
+        os.chmod(tmp_name, _file_mode(fname))
+        os.replace(tmp_name, fname)
+    except BaseException:
+        os.unlink(tmp_name)
+        raise
+
+
+def solution_reader(exam_vars):
+    """Returns a function mapping a solution vector (e.g. `Response().solution`)
+    to the values of `exam_vars`, which may include fixed (int) exams."""
+    fixed = np.array([isinstance(x, int) for x in exam_vars], dtype=bool)
+    index = np.array([0 if isinstance(x, int) else x.Index() for x in exam_vars], dtype=np.int64)
+    constants = np.array([x if isinstance(x, int) else 0 for x in exam_vars], dtype=np.int64)
+
+    def read(solution):
+        return np.where(fixed, constants, np.asarray(solution, dtype=np.int64)[index])
+    return read
+
+
+class BackgroundWriter:
+    """Calls `write(item)` on a background thread with the latest submitted
+    item, at most once per `min_interval` seconds. Items submitted while a
+    write is pending replace it, so a slow writer never delays `submit`."""
+
+    def __init__(self, write, min_interval=0, on_error=None):
+        self.__write = write
+        self.__min_interval = min_interval
+        self.__on_error = on_error
+        self.__condition = threading.Condition()
+        self.__pending = None
+        self.__has_pending = False
+        self.__closed = False
+        self.write_count = 0
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    def submit(self, item):
+        with self.__condition:
+            self.__pending = item
+            self.__has_pending = True
+            self.__condition.notify()
+
+    def close(self):
+        """Writes the last pending item (if any) and stops the thread."""
+        with self.__condition:
+            self.__closed = True
+            self.__condition.notify()
+        self.__thread.join()
+
+    def __run(self):
+        last_write = float('-inf')
+        while True:
+            with self.__condition:
+                while not self.__has_pending and not self.__closed:
+                    self.__condition.wait()
+                # throttle, unless closing (the latest item is written right away)
+                while not self.__closed:
+                    remaining = last_write + self.__min_interval - time.monotonic()
+                    if remaining <= 0: break
+                    self.__condition.wait(remaining)
+                if not self.__has_pending:
+                    return
+                item = self.__pending
+                self.__pending = None
+                self.__has_pending = False
+
+            try:
+                self.__write(item)
+                self.write_count += 1
+            except Exception as e:
+                if self.__on_error: self.__on_error(e)
+            last_write = time.monotonic()
@@ -0,0 +1,218 @@
+import os
+import time
+import queue
+import threading
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from ortools.sat import cp_model_pb2
+from ortools.sat.python import cp_model
+
+#### Solver portfolio ####
+# Runs several differently configured CP-SAT solves of the same model in a
+# process pool. Workers report improving solutions to the parent, which keeps
+# the best incumbent and bound across all of them and stops every worker once
+# the gap target or the time limit is reached.
+
+# Search configurations, cycled through by the portfolio members
+PORTFOLIO_STRATEGIES = [
+    {},
+    {'search_branching': cp_model.PORTFOLIO_WITH_QUICK_RESTART_SEARCH},
+    {'linearization_level': 2},
+    {'optimize_with_core': True},
+    {'search_branching': cp_model.PSEUDO_COST_SEARCH},
+    {'linearization_level': 0},
+    {'search_branching': cp_model.LP_SEARCH},
+    {'search_branching': cp_model.HINT_SEARCH},
+]
+
+def portfolio_configs(size, num_cores=None):
+    # split the available cores evenly between the portfolio members
+    num_cores = num_cores or os.cpu_count() or 1
+    num_workers = max(1, num_cores // size)
+    configs = []
+    for k in range(size):
+        config = dict(PORTFOLIO_STRATEGIES[k % len(PORTFOLIO_STRATEGIES)])
+        config['random_seed'] = k
+        config['num_workers'] = num_workers
+        configs.append(config)
+    return configs
+
+
+def pool_context():
+    # fresh worker processes rather than forks, which would copy the threads
+    # (and held locks) of the calling process; for pools started from scripts
+    # guarded by __main__ (the portfolio itself forks, see solve_portfolio)
+    return multiprocessing.get_context('forkserver' if 'forkserver' in multiprocessing.get_all_start_methods()
+                                       else 'spawn')
+
+
+def _read(solution, indices):
+    # values of the watched variables in a solution vector
+    return np.asarray(solution, dtype=np.int64)[indices].tolist()
+
+
+class _ReportingCallback(cp_model.CpSolverSolutionCallback):
+    def __init__(self, worker_id, indices, reports):
+        cp_model.CpSolverSolutionCallback.__init__(self)
+        self.__worker_id = worker_id
+        self.__indices = indices
+        self.__reports = reports
+
+    def on_solution_callback(self):
+        # only the watched values are sent, to keep the search thread fast
+        values = _read(self.Response().solution, self.__indices)
+        self.__reports.put((self.__worker_id, self.ObjectiveValue(), self.BestObjectiveBound(), values))
+
+
+def _solve_worker(worker_id, model_bytes, config, time_limit, indices, reports, stop):
+    model = cp_model.CpModel()
+    model.Proto().ParseFromString(model_bytes)
+
+    solver = cp_model.CpSolver()
+    for key, value in config.items():
+        setattr(solver.parameters, key, value)
+    if time_limit > 0:
+        solver.parameters.max_time_in_seconds = time_limit
+
+    # stop searching as soon as the parent asks to
+    done = threading.Event()
+    def watch():
+        while not done.is_set():
+            if stop.wait(0.1):
+                solver.StopSearch()
+                return
+    watcher = threading.Thread(target=watch, daemon=True)
+    watcher.start()
+
+    callback = _ReportingCallback(worker_id, indices, reports)
+    try:
+        status = solver.SolveWithSolutionCallback(model, callback)
+    finally:
+        done.set()
+
+    response = solver.ResponseProto()
+    values = _read(response.solution, indices) if response.solution else []
+    return worker_id, status, response.objective_value, response.best_objective_bound, values
+
+
+class PortfolioResult:
+    """Best solution found by the portfolio; supports the `CpSolver` calls
+    used to read back the values of watched variables."""
+
+    def __init__(self, status, objective, bound, values, wall_time, positions=None):
+        self.status = status
+        self.objective = objective
+        self.bound = bound
+        self.values = values
+        self.wall_time = wall_time
+        # proto index -> position in `values`
+        self.positions = positions or {}
+
+    def Value(self, var):
+        if isinstance(var, int): return var
+        index = var.Index()
+        # negated literals have negative indices
+        if index < 0: return 1 - self.values[self.positions[-index-1]]
+        return self.values[self.positions[index]]
+
+    def BooleanValue(self, literal):
+        return bool(self.Value(literal))
+
+    def ObjectiveValue(self):
+        return self.objective
+
+    def BestObjectiveBound(self):
+        return self.bound
+
+    def WallTime(self):
+        return self.wall_time
+
+    def StatusName(self, status=None):
+        return cp_model_pb2.CpSolverStatus.Name(self.status if status is None else status)
+
+
+def solve_portfolio(model, configs, time_limit=0, absolute_gap_limit=0, on_improvement=None, log=print,
+                    on_start=None, watched=None):
+    """Solves `model` (minimization) with one process per config.
+
+    Only the values of `watched` variables (all variables by default; ints
+    are skipped) are sent back by the workers and can be read from the
+    result. `on_improvement(result)` is called in the parent for each new
+    incumbent.
+    The worker processes are forked before `on_start()` is called, so the
+    caller should start its own threads (e.g. background writers) there:
+    forking a multithreaded process can copy locks in a held state."""
+    start_time = time.perf_counter()
+    model_bytes = model.Proto().SerializeToString()
+    if watched is None:
+        indices = list(range(len(model.Proto().variables)))
+    else:
+        # (a negated literal is read from its variable)
+        indices = sorted({max(var.Index(), -var.Index()-1) for var in watched if not isinstance(var, int)})
+    positions = {index: k for k, index in enumerate(indices)}
+    indices = np.array(indices, dtype=np.int64)
+    best = None
+    best_bound = float('-inf')
+    statuses = []
+
+    def gap_closed():
+        return best is not None and best.objective - best_bound <= absolute_gap_limit
+
+    def record(worker_id, objective, bound, values):
+        nonlocal best, best_bound
+        best_bound = max(best_bound, bound)
+        if best is None or objective < best.objective:
+            best = PortfolioResult(cp_model.FEASIBLE, objective, best_bound, values, time.perf_counter() - start_time,
+                                   positions)
+            log(f'Portfolio worker #{worker_id} improved objective value = {objective}, best bound = {best_bound}')
+            if on_improvement: on_improvement(best)
+
+    # fork where available, so that the calling script is not re-executed
+    ctx = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else None)
+    with ctx.Manager() as manager, \
+         ProcessPoolExecutor(max_workers=len(configs), mp_context=ctx) as pool:
+        reports = manager.Queue()
+        stop = manager.Event()
+        # (with fork, the pool starts all its processes on the first submit)
+        futures = [pool.submit(_solve_worker, k, model_bytes, config, time_limit, indices, reports, stop)
+                   for k, config in enumerate(configs)]
+        if on_start: on_start()
+
+        while not all(f.done() for f in futures):
+            try:
+                record(*reports.get(timeout=0.1))
+            except queue.Empty:
+                pass
+
+            if gap_closed() or (time_limit > 0 and time.perf_counter() - start_time > time_limit):
+                stop.set()
+            # a proof of optimality/infeasibility by one member ends the race
+            # (a crashed member does not end it)
+            for f in futures:
+                if f.done() and f.exception() is None and f.result()[1] in (cp_model.OPTIMAL, cp_model.INFEASIBLE):
+                    stop.set()
+
+        while not reports.empty():
+            record(*reports.get())
+
+        for k, f in enumerate(futures):
+            if f.exception() is not None:
+                log(f'Portfolio worker #{k} failed: {f.exception()!r}')
+                continue
+            worker_id, status, objective, bound, values = f.result()
+            statuses.append(status)
+            if status in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+                record(worker_id, objective, bound, values)
+
+    wall_time = time.perf_counter() - start_time
+    if cp_model.INFEASIBLE in statuses:
+        return PortfolioResult(cp_model.INFEASIBLE, None, None, [], wall_time)
+    if best is None:
+        return PortfolioResult(cp_model.MODEL_INVALID if cp_model.MODEL_INVALID in statuses else cp_model.UNKNOWN,
+                               None, None, [], wall_time)
+
+    best.status = cp_model.OPTIMAL if gap_closed() else cp_model.FEASIBLE
+    best.bound = best_bound
+    best.wall_time = wall_time
+    return best
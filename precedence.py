@@ -0,0 +1,114 @@
+#### Precedence graph ####
+# Precedence pairs (i, j) mean that exam i is scheduled no later than exam j.
+# Since the relation is transitive, a pair implied by a chain of other pairs
+# need not be posted to the model, and the exams of a cycle must all share a
+# date (which is most likely a data entry error).
+
+class PrecedenceGraph:
+    def __init__(self, pairs=()):
+        # insertion-ordered set of pairs
+        self.pairs = {}
+        for i, j in pairs:
+            self.add(i, j)
+
+    def add(self, i, j):
+        """Adds the pair, moving it to the end if present; returns whether it was a duplicate."""
+        duplicate = self.pairs.pop((i, j), None) is not None
+        self.pairs[(i, j)] = True
+        return duplicate
+
+    def __iter__(self):
+        return iter(self.pairs)
+
+    def __len__(self):
+        return len(self.pairs)
+
+    def successors(self):
+        succ = {}
+        for i, j in self.pairs:
+            succ.setdefault(i, []).append(j)
+            succ.setdefault(j, [])
+        return succ
+
+    def components(self):
+        """Strongly connected components, in topological order (Tarjan)."""
+        succ = self.successors()
+        index, lowlink, on_stack = {}, {}, set()
+        stack, components = [], []
+
+        for root in succ:
+            if root in index: continue
+            # iterative DFS: (node, iterator over its successors)
+            index[root] = lowlink[root] = len(index)
+            stack.append(root); on_stack.add(root)
+            work = [(root, iter(succ[root]))]
+            while work:
+                node, children = work[-1]
+                for child in children:
+                    if child not in index:
+                        index[child] = lowlink[child] = len(index)
+                        stack.append(child); on_stack.add(child)
+                        work.append((child, iter(succ[child])))
+                        break
+                    if child in on_stack:
+                        lowlink[node] = min(lowlink[node], index[child])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        lowlink[parent] = min(lowlink[parent], lowlink[node])
+                    if lowlink[node] == index[node]:
+                        component = []
+                        while True:
+                            member = stack.pop(); on_stack.discard(member)
+                            component.append(member)
+                            if member == node: break
+                        components.append(component)
+
+        # Tarjan emits components in reverse topological order
+        components.reverse()
+        return components
+
+    def cycles(self):
+        return [sorted(c) for c in self.components() if len(c) > 1]
+
+    def reduced(self):
+        """An equivalent, minimal set of pairs: a ring through each cycle plus
+        the transitive reduction of the graph between cycles."""
+        components = self.components()
+        component_of = {node: k for k, c in enumerate(components) for node in c}
+
+        # chain the members of each cycle into a ring
+        pairs = []
+        for c in components:
+            if len(c) > 1:
+                c = sorted(c)
+                pairs.extend(zip(c, c[1:] + c[:1]))
+
+        # condensation edges, each represented by its first original pair
+        representative = {}
+        for i, j in self.pairs:
+            ci, cj = component_of[i], component_of[j]
+            if ci != cj:
+                representative.setdefault((ci, cj), (i, j))
+        children = [[] for _ in components]
+        for ci, cj in representative:
+            children[ci].append(cj)
+
+        # reach[c]: bitset of components reachable from c by a path of length >= 1;
+        # components are in topological order, so visit them in reverse
+        reach = [0] * len(components)
+        for c in reversed(range(len(components))):
+            for d in children[c]:
+                reach[c] |= reach[d] | (1 << d)
+
+        # a pair is redundant if its target is reachable through a child
+        # (reach[d] never contains d itself, so all children can be merged)
+        covered = [0] * len(components)
+        for c in range(len(components)):
+            for d in children[c]:
+                covered[c] |= reach[d]
+        for (ci, cj), pair in representative.items():
+            if not (covered[ci] >> cj) & 1:
+                pairs.append(pair)
+        return pairs
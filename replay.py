@@ -0,0 +1,149 @@
+import os
+import json
+import time
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+from ortools.sat import sat_parameters_pb2
+from ortools.sat.python import cp_model
+from model import FirstSolutionTimer
+from portfolio import pool_context
+
+#### Model export and replay ####
+# A run of the scheduler can export the model it solves (including hints),
+# the proto indices of its exam and violation variables by name, and the
+# run's parameters. Replaying solves the exported model under a grid of
+# solver parameter sets, without access to the sheets.
+
+def export_model(dirname, model, exams, ideal_violations, exam_names, params=None):
+    os.makedirs(dirname, exist_ok=True)
+    with open(os.path.join(dirname, 'model.pb'), 'wb') as f:
+        f.write(model.Proto().SerializeToString())
+
+    # exam -> variable index, or its date if fixed
+    variables = {
+        'exams': {name: ({'index': var.Index()} if not isinstance(var, int) else {'fixed': var})
+                  for name, var in zip(exam_names, exams)},
+        'violations': [[exam_names[i], exam_names[j], literal.Index()]
+                       for (i, j), literal in ideal_violations.items()],
+    }
+    with open(os.path.join(dirname, 'variables.json'), 'w', encoding='utf-8') as f:
+        json.dump(variables, f, ensure_ascii=False, indent=1)
+    with open(os.path.join(dirname, 'params.json'), 'w') as f:
+        json.dump(params or {}, f, indent=2)
+
+
+def load_export(dirname):
+    model = cp_model.CpModel()
+    with open(os.path.join(dirname, 'model.pb'), 'rb') as f:
+        model.Proto().ParseFromString(f.read())
+    with open(os.path.join(dirname, 'variables.json'), encoding='utf-8') as f:
+        variables = json.load(f)
+    with open(os.path.join(dirname, 'params.json')) as f:
+        params = json.load(f)
+    return model, variables, params
+
+
+def parse_grid(specs):
+    """['num_workers=1,8', 'linearization_level=0,2'] -> list of parameter dicts
+    (the cartesian product); enum values are given by name."""
+    fields = sat_parameters_pb2.SatParameters.DESCRIPTOR.fields_by_name
+    axes = []
+    for spec in specs:
+        key, _, values = spec.partition('=')
+        if key not in fields:
+            raise ValueError(f'Unknown solver parameter: {key}')
+        field = fields[key]
+        parsed = []
+        for value in values.split(','):
+            if field.enum_type is not None:
+                parsed.append(field.enum_type.values_by_name[value].number)
+            elif field.type == field.TYPE_BOOL:
+                parsed.append(value.lower() in ('1', 'true', 'yes'))
+            elif field.type in (field.TYPE_DOUBLE, field.TYPE_FLOAT):
+                parsed.append(float(value))
+            else:
+                parsed.append(int(value))
+        axes.append([(key, v) for v in parsed])
+    return [dict(combination) for combination in itertools.product(*axes)]
+
+
+def format_config(config):
+    fields = sat_parameters_pb2.SatParameters.DESCRIPTOR.fields_by_name
+    items = []
+    for key, value in config.items():
+        if fields[key].enum_type is not None:
+            value = fields[key].enum_type.values_by_number[value].name
+        items.append(f'{key}={value}')
+    return ' '.join(items) or '(defaults)'
+
+
+def _replay_worker(model_bytes, config, time_limit):
+    model = cp_model.CpModel()
+    model.Proto().ParseFromString(model_bytes)
+    solver = cp_model.CpSolver()
+    if time_limit > 0:
+        solver.parameters.max_time_in_seconds = time_limit
+    for key, value in config.items():
+        setattr(solver.parameters, key, value)
+
+    timer = FirstSolutionTimer()
+    status = solver.SolveWithSolutionCallback(model, timer)
+    found = status in (cp_model.OPTIMAL, cp_model.FEASIBLE)
+    return {
+        'config': config,
+        'status': solver.StatusName(status),
+        'first_feasible': timer.first_solution_time,
+        'wall_time': solver.WallTime(),
+        'objective': solver.ObjectiveValue() if found else None,
+        'bound': solver.BestObjectiveBound() if found else None,
+    }
+
+
+def replay(model, configs, time_limit, jobs=1):
+    model_bytes = model.Proto().SerializeToString()
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=pool_context()) as pool:
+        futures = [pool.submit(_replay_worker, model_bytes, config, time_limit) for config in configs]
+        return [f.result() for f in futures]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay an exported model under a grid of solver parameters')
+    parser.add_argument('export',
+                        help='Directory written by the scheduler (export_model_dir)')
+    parser.add_argument('--grid',
+                        nargs='*',
+                        default=[],
+                        help='Parameter values, e.g. num_workers=1,8 search_branching=AUTOMATIC_SEARCH,PORTFOLIO_SEARCH')
+    parser.add_argument('--time-limit',
+                        type=float,
+                        help='Solver time limit per run (seconds; default: that of the exported run)')
+    parser.add_argument('--jobs',
+                        type=int,
+                        default=max(1, (os.cpu_count() or 1) // 8),
+                        help='Runs solved in parallel (runs sharing cores distort timings)')
+    parser.add_argument('--output',
+                        help='Results JSON file')
+    args = parser.parse_args()
+
+    model, variables, params = load_export(args.export)
+    time_limit = args.time_limit if args.time_limit is not None else params.get('time_limit', 60)
+    configs = parse_grid(args.grid)
+    print(f'{len(variables["exams"])} exams, {len(model.Proto().variables)} variables, '
+          f'{len(model.Proto().constraints)} constraints; {len(configs)} runs of up to {time_limit:g} s, {args.jobs} at a time')
+
+    start_time = time.perf_counter()
+    results = replay(model, configs, time_limit, args.jobs)
+
+    print(f'{"first (s)":>10} {"solve (s)":>10} {"status":>10} {"objective":>10} {"bound":>10}  parameters')
+    for r in results:
+        first = f'{r["first_feasible"]:.2f}' if r['first_feasible'] is not None else '-'
+        print(f'{first:>10} {r["wall_time"]:>10.2f} {r["status"]:>10} {str(r["objective"]):>10} {str(r["bound"]):>10}  '
+              f'{format_config(r["config"])}')
+    print(f'Total {time.perf_counter() - start_time:.1f} s')
+
+    if args.output:
+        for r in results:
+            r['parameters'] = format_config(r['config'])
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
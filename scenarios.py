@@ -0,0 +1,234 @@
+import os
+import csv
+import copy
+import time
+import argparse
+import tomllib
+from concurrent.futures import ProcessPoolExecutor
+from ortools.sat.python import cp_model
+from instance import INPUT_SHEETS, parse_instance, load_snapshot
+from model import build_model, build_options_from_params, FirstSolutionTimer, symmetry_classes, order_symmetric_values
+from patterns import preprocess_pattern, NameMatcher
+from evaluate import ScheduleEvaluator
+from heuristic import heuristic_schedule
+from warm_start import add_full_hints
+from explain import explain_infeasibility, describe_conflict
+from workbook import FakeWorkbook
+from portfolio import pool_context
+
+#### Scenario batch ####
+# What-if variants of one base instance, each given as overrides in a TOML
+# file, e.g.
+#
+#   [[scenario]]
+#   name = "more seats"
+#   add_capacity = { "22/01/2025" = 50, "29/01/2025" = 50 }
+#   capacity = { "05/02/2025" = 300 }
+#   fixed = { "0372-1005-a" = "29/01/2025", "0372-1033-a" = "" }
+#
+#   [[scenario.gaps]]
+#   exams1 = "0372-10##-a"
+#   exams2 = "0372-11##-a"
+#   min_days = 3
+#   weight = 5
+#
+# Gap overrides use the patterns of the gaps sheet; only the values given are
+# changed (0 removes a gap). The scenarios, and the base instance, are solved
+# concurrently on a shared budget of cores.
+
+def _date(instance, date):
+    t = instance.date_index.get(date)
+    if t is None:
+        raise ValueError(f'Unknown date: {date}')
+    return t
+
+def apply_scenario(instance, scenario):
+    """A copy of `instance` with the overrides of `scenario` applied."""
+    instance = copy.deepcopy(instance)
+    instance.hints = {}
+
+    # overridden constraints no longer come from a sheet row
+    for date, capacity in scenario.get('capacity', {}).items():
+        instance.dates_capacity[_date(instance, date)] = capacity
+        instance.rows.pop(('capacity', _date(instance, date)), None)
+    for date, extra in scenario.get('add_capacity', {}).items():
+        instance.dates_capacity[_date(instance, date)] += extra
+        instance.rows.pop(('capacity', _date(instance, date)), None)
+
+    exam_index = instance.exam_index
+    for exam, date in scenario.get('fixed', {}).items():
+        if exam not in exam_index:
+            raise ValueError(f'Unknown exam: {exam}')
+        instance.rows.pop(('fix', exam_index[exam]), None)
+        if date:
+            instance.exam_on_date[exam_index[exam]] = _date(instance, date)
+        else:
+            instance.exam_on_date.pop(exam_index[exam], None)
+
+    # ideal gaps as requested, including those disabled by a minimal gap
+    requested = {pair: days for pair, days in instance.ideal_days_between_exams.items() if days}
+    requested.update(instance.disabled_ideal_days)
+
+    matcher = NameMatcher(instance.exam_names, exam_index)
+    for gap in scenario.get('gaps', []):
+        pairs = matcher.matching_pairs(preprocess_pattern(gap['exams1']), preprocess_pattern(gap['exams2']))
+        if not pairs:
+            raise ValueError(f'No exams match {gap["exams1"]} / {gap["exams2"]}')
+        for i, j in pairs:
+            pair = (min(i, j), max(i, j))
+            if 'min_days' in gap:
+                instance.rows.pop(('min', pair), None)
+                if gap['min_days'] > 0:
+                    instance.min_days_between_exams[pair] = gap['min_days']
+                else:
+                    instance.min_days_between_exams.pop(pair, None)
+            if 'ideal_days' in gap:
+                instance.rows.pop(('ideal', pair), None)
+                if gap['ideal_days'] > 0:
+                    requested[pair] = gap['ideal_days']
+                    instance.weights.setdefault(pair, 1)
+                else:
+                    requested.pop(pair, None)
+                    instance.weights.pop(pair, None)
+            if 'weight' in gap and pair in requested:
+                instance.rows.pop(('ideal', pair), None)
+                instance.weights[pair] = gap['weight']
+
+    # ideal gaps within the minimal ones are disabled, as when parsing
+    instance.ideal_days_between_exams = {}
+    instance.disabled_ideal_days = {}
+    for pair, ideal_days in requested.items():
+        if ideal_days <= instance.min_days_between_exams.get(pair, 0):
+            instance.ideal_days_between_exams[pair] = 0
+            instance.disabled_ideal_days[pair] = ideal_days
+        else:
+            instance.ideal_days_between_exams[pair] = ideal_days
+    return instance
+
+
+def solve_scenario(instance, build_options, time_limit, num_workers, heuristic_time=0):
+    start_time = time.perf_counter()
+    model, exams, ideal_violations, auxiliary = build_model(instance, build_options)
+    if heuristic_time > 0:
+        schedule, _, _, _ = heuristic_schedule(instance, heuristic_time)
+        if build_options.get('symmetry_breaking', True):
+            schedule = order_symmetric_values(symmetry_classes(instance), schedule)
+        add_full_hints(model, exams, ideal_violations, auxiliary, instance, schedule)
+
+    solver = cp_model.CpSolver()
+    if time_limit > 0:
+        solver.parameters.max_time_in_seconds = time_limit
+    solver.parameters.num_workers = num_workers
+    timer = FirstSolutionTimer()
+    status = solver.SolveWithSolutionCallback(model, timer)
+
+    result = {'status': solver.StatusName(status), 'objective': None, 'bound': None, 'violations': None,
+              'peak_load': None, 'first_feasible': timer.first_solution_time, 'solve': solver.WallTime(),
+              'conflict': ''}
+    if status in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+        evaluation = ScheduleEvaluator(instance).evaluate([solver.Value(x) for x in exams])
+        result.update(objective=int(evaluation.objective[0]), bound=solver.BestObjectiveBound(),
+                      violations=int(evaluation.ideal_violations[0].sum()),
+                      peak_load=max(l / c for l, c in zip(evaluation.load[0], instance.dates_capacity) if c))
+    elif status == cp_model.INFEASIBLE:
+        _, _, conflict = explain_infeasibility(instance, time_limit, log=lambda line: None)
+        result['conflict'] = ' | '.join(describe_conflict(instance, group, keys) for group, keys in conflict)
+    result['wall_time'] = time.perf_counter() - start_time
+    return result
+
+
+def run_scenarios(base, scenarios, build_options, time_limit, jobs, num_cores=None, heuristic_time=0):
+    """Solves the base instance and each (name, overrides) scenario, `jobs` at
+    a time, each solver with an equal share of `num_cores` cores. Returns
+    result dicts in order, the base first."""
+    instances = [('base', base)] + [(name, apply_scenario(base, scenario)) for name, scenario in scenarios]
+    num_cores = num_cores or os.cpu_count() or 1
+    jobs = max(1, min(jobs, len(instances), num_cores))
+    num_workers = max(1, num_cores // jobs)
+
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=pool_context()) as pool:
+        futures = [pool.submit(solve_scenario, instance, build_options, time_limit, num_workers, heuristic_time)
+                   for _, instance in instances]
+        results = [dict(scenario=name, **f.result()) for (name, _), f in zip(instances, futures)]
+
+    base_objective = results[0]['objective']
+    for r in results:
+        found = r['objective'] is not None and base_objective is not None
+        r['delta'] = r['objective'] - base_objective if found else None
+    return results
+
+
+def load_scenarios(fname):
+    with open(fname, 'rb') as f:
+        scenarios = tomllib.load(f).get('scenario', [])
+    return [(s.get('name', f'scenario {k+1}'), s) for k, s in enumerate(scenarios)]
+
+
+# columns of the comparison table
+COLUMNS = ['scenario', 'status', 'objective', 'delta', 'bound', 'violations', 'peak_load',
+           'first_feasible', 'solve', 'wall_time', 'conflict']
+
+def write_table(fname, results):
+    with open(fname, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, COLUMNS, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(results)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Solve what-if scenarios of one instance in parallel')
+    parser.add_argument('scenarios',
+                        help='TOML file of scenario overrides')
+    parser.add_argument('--workbook',
+                        help='Local workbook JSON file')
+    parser.add_argument('--from-snapshot',
+                        help='Instance snapshot file (e.g. saved by scheduler.py --save-snapshot)')
+    parser.add_argument('--params',
+                        help='TOML params file (time limit, heuristic and model build options)')
+    parser.add_argument('--jobs',
+                        type=int,
+                        default=os.cpu_count() or 1,
+                        help='Scenarios solved at a time')
+    parser.add_argument('--cores',
+                        type=int,
+                        default=os.cpu_count() or 1,
+                        help='Cores shared by the solvers running at a time')
+    parser.add_argument('--output',
+                        default='scenarios.csv',
+                        help='Comparison table CSV file')
+    args = parser.parse_args()
+    if not (args.workbook or args.from_snapshot):
+        parser.error('one of --workbook or --from-snapshot is required')
+
+    params = {}
+    if args.params:
+        with open(args.params, 'rb') as f:
+            params = tomllib.load(f)
+    time_limit = params.get('time_limit_in_mins', 1) * 60.0
+    heuristic_time = params.get('heuristic_time_in_secs', 0)
+
+    if args.from_snapshot:
+        base = load_snapshot(args.from_snapshot)
+    else:
+        workbook = FakeWorkbook.from_json(args.workbook)
+        base = parse_instance(workbook.read_sheets(list(INPUT_SHEETS)), print)
+    scenarios = load_scenarios(args.scenarios)
+    print(f'{len(scenarios)} scenarios of {base.num_exams} exams, up to {time_limit:g} s each, '
+          f'{min(args.jobs, len(scenarios) + 1)} at a time on {args.cores} cores')
+
+    start_time = time.perf_counter()
+    results = run_scenarios(base, scenarios, build_options_from_params(params), time_limit,
+                            args.jobs, args.cores, heuristic_time)
+
+    print(f'{"objective":>10} {"delta":>8} {"violated":>9} {"peak":>6} {"first (s)":>10} {"solve (s)":>10} {"status":>10}  scenario')
+    for r in results:
+        first = f'{r["first_feasible"]:.2f}' if r['first_feasible'] is not None else '-'
+        peak = f'{r["peak_load"]:.0%}' if r['peak_load'] is not None else '-'
+        print(f'{str(r["objective"]):>10} {str(r["delta"]):>8} {str(r["violations"]):>9} {peak:>6} {first:>10} '
+              f'{r["solve"]:>10.2f} {r["status"]:>10}  {r["scenario"]}')
+        if r['conflict']:
+            print(f'{"":>10} conflict: {r["conflict"]}')
+    print(f'Total {time.perf_counter() - start_time:.1f} s')
+
+    write_table(args.output, results)
+    print(f'Wrote {args.output}')
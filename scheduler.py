@@ -1,11 +1,25 @@
 import gspread
 from ortools.sat.python import cp_model
 from google.oauth2 import service_account
-import re
+from instance import INPUT_SHEETS, parse_instance, parse_hints, save_snapshot, load_snapshot
+from model import build_model, weighted_violations, build_options_from_params, symmetry_classes, order_symmetric_values, instance_fingerprint, model_cache_key, ModelCache
+from replay import export_model
+from warm_start import repair_schedule, add_full_hints
+from evaluate import ScheduleEvaluator
+from heuristic import heuristic_schedule
+from explain import explain_infeasibility, describe_conflict
+from incremental import read_schedule_csv, reopened_exams, restrict_model
+from portfolio import portfolio_configs, solve_portfolio
+from workbook import GSheetWorkbook, FakeWorkbook
+from metrics import Metrics, SolverLogTimer
+from persistence import atomic_write, solution_reader, BackgroundWriter
 import random
 from datetime import datetime
 from zoneinfo import ZoneInfo
 import argparse
+import dataclasses
+import os
+import time
 import tomllib
 import csv
 
@@ -13,32 +27,6 @@ import warnings
 warnings.filterwarnings("ignore", category=DeprecationWarning) 
 
 #### helper functions ####
-def preprocess_name(name):
-    # strip consecutive whitespaces
-    name = re.sub(' +', ' ', name)
-    return name
-
-def preprocess_pattern(pattern):
-    # strip consecutive whitespaces
-    pattern = re.sub(' +', ' ', pattern)
-    # use '#' as a wildcard character (in addition to '.')
-    pattern = pattern.replace('#', '.')
-    return pattern
-
-def get_matching(pattern, names, index):
-    return [index[name] for name in names if re.fullmatch(pattern,name)]
-
-def get_matching_pairs(pattern1, pattern2, names, index):
-    matches = get_matching(pattern1,names,index)
-    subs = [re.sub(pattern1,pattern2,names[i]) for i in matches]
-
-    pairs = []
-    for i1,sub in zip(matches,subs):
-        for i2 in get_matching(sub,names,index):
-            if i1 != i2: pairs.append((i1,i2))
-    return pairs
-
-
 def get_timestamp():
     timezone = ZoneInfo('Asia/Jerusalem')
     return datetime.now(tz=timezone).strftime("%d-%m-%Y %H:%M:%S")
@@ -49,28 +37,18 @@ def omit_from_output(exam_name):
 
 
 
-def extract_solution_from_solver(solver, exam_vars, exam_names, dates):
-    # dump solution into a dictionary
+# parse date labels once, rather than per solution
+def parse_dates(dates):
+    return [datetime.strptime(date, '%d/%m/%Y').date() for date in dates]
+
+def extract_solution_from_values(values, exam_names, parsed_dates):
+    # dump solution (a date index per exam) into a dictionary
     solution = {}
-    for i in range(num_exams):
-        exam = exam_names[i]
+    for i, exam in enumerate(exam_names):
         if omit_from_output(exam): continue
-        date = dates[solver.Value(exam_vars[i])]
-        solution[exam] = datetime.strptime(date, '%d/%m/%Y').date()
-    
-    return solution
+        solution[exam] = parsed_dates[values[i]]
 
-# dump failed soft constraints into a list
-def extract_violations_from_solver(solver, bool_vars_dict, exam_vars,
-                                exam_names, requested_gaps):
-    violations = []
-    for (i,j),b in bool_vars_dict.items():
-        if solver.Value(b):
-            requested = requested_gaps[(i,j)]
-            actual = abs(solver.Value(exam_vars[i]) - solver.Value(exam_vars[j]))
-            violations.append((exam_names[i],exam_names[j],requested,actual))
-    
-    return violations
+    return solution
 
 def write_solution_to_csv(fname, solution):
     # prepare solution
@@ -80,7 +58,8 @@ def write_solution_to_csv(fname, solution):
         date = date.strftime('%d/%m/%Y')
         data.append([exam, date])
 
-    with open(fname, 'w') as f:
+    # (readers never see a partially written file)
+    with atomic_write(fname) as f:
         writer = csv.writer(f)
         writer.writerows(data)
 
@@ -116,6 +95,18 @@ def write_solution_to_gsheet(worksheet, solution, violations):
                     value_input_option="USER_ENTERED")
 
 
+def write_log_to_gsheet(worksheet, lines):
+    start_row = 1
+    end_row = worksheet.row_count
+    range_name = f'A{start_row}:A{end_row}'
+    worksheet.batch_clear([range_name])
+
+    worksheet.update(range_name=range_name,
+                     values=[lines], 
+                     major_dimension='COLUMNS',
+                     value_input_option="USER_ENTERED")
+
+
 # simple logger
 logger = []
 def log(str):
@@ -125,15 +116,15 @@ def log(str):
 
 # Solver callback
 class MySolutionCallback(cp_model.CpSolverSolutionCallback):
-    def __init__(self, exam_vars, exam_names, dates, log_func):
+    def __init__(self, exam_vars, writers, log_func, metrics=None):
         cp_model.CpSolverSolutionCallback.__init__(self)
         
-        self.__exam_vars = exam_vars
-        self.__exam_names = exam_names
-        self.__dates = dates
+        self.__read_values = solution_reader(exam_vars)
+        self.__writers = writers
         
         self.__solution_count = 1
         self.__logger = log_func
+        self.__metrics = metrics
 
     def on_solution_callback(self):
         """Called on each new solution."""
@@ -141,10 +132,13 @@ class MySolutionCallback(cp_model.CpSolverSolutionCallback):
         bound = self.BestObjectiveBound()
         self.__logger(f'Feasible solution #{self.__solution_count} found, objective value = {obj}, best bound = {bound}')
         self.__solution_count += 1
+        if self.__metrics:
+            self.__metrics.record_solution(self.WallTime(), obj, bound)
 
-        # save solution locally
-        solution = extract_solution_from_solver(self, self.__exam_vars, self.__exam_names, self.__dates)
-        write_solution_to_csv('schedule.csv', solution)
+        # save (and stream) the solution in the background, so the search is not slowed down
+        values = self.__read_values(self.Response().solution)
+        for writer in self.__writers:
+            writer.submit(values)
 
     def solution_count(self):
         """Returns the number of solutions found."""
@@ -154,8 +148,17 @@ class MySolutionCallback(cp_model.CpSolverSolutionCallback):
 ### Read args
 parser = argparse.ArgumentParser(description='TAU exam scheduler')
 parser.add_argument('--secrets', 
-                    help='TOML secrets file',
-                    required=True)
+                    help='TOML secrets file')
+parser.add_argument('--workbook', 
+                    help='Local JSON workbook to use instead of Google Sheets')
+parser.add_argument('--workbook-latency', 
+                    type=float,
+                    default=0.0,
+                    help='Simulated API round trip of the local workbook (seconds)')
+parser.add_argument('--from-snapshot', 
+                    help='Load the instance from a snapshot file (no sheet access)')
+parser.add_argument('--save-snapshot', 
+                    help='Save the parsed instance to a snapshot file')
 parser.add_argument('--params', 
                     help='TOML params file',
                     required=True)
@@ -164,10 +167,13 @@ parser.add_argument('--debug',
                     default=False,
                     help='Printout solver log')
 args = parser.parse_args()
+if not (args.secrets or args.workbook or args.from_snapshot):
+    parser.error('one of --secrets, --workbook or --from-snapshot is required')
+
+# phase timings and solver progress of this run
+metrics = Metrics()
 
 # read config TOML files
-with open(args.secrets, 'rb') as f:
-    secrets = tomllib.load(f)
 with open(args.params, 'rb') as f:
     params = tomllib.load(f)
 debug = args.debug
@@ -176,341 +182,278 @@ debug = args.debug
 time_limit_in_mins = params['time_limit_in_mins']
 absolute_gap_limit = params['absolute_gap_limit']
 warm_start_prob = params['warm_start_prob']
+warm_start_source = params.get('warm_start_source', '')
+if warm_start_source not in ('', 'sheet', 'csv'):
+    parser.error(f'warm_start_source must be "sheet", "csv" or "" (got "{warm_start_source}")')
+heuristic_time_in_secs = params.get('heuristic_time_in_secs', 0)
+export_model_dir = params.get('export_model_dir', '')
 dump_stats = params['log_stats']
 dump_duplicates = params['log_duplicates']
+model_cache_dir = params.get('model_cache_dir', '')
+model_cache_entries = params.get('model_cache_entries', 20)
+incremental = params.get('incremental', False)
+incremental_radius = params.get('incremental_radius', 1)
+incremental_mode = params.get('incremental_mode', 'fix')
+portfolio_size = params.get('portfolio_size', 0)
+save_interval_in_secs = params.get('save_interval_in_secs', 1.0)
+stream_interval_in_secs = params.get('stream_interval_in_secs', 0)
+build_options = build_options_from_params(params)
+if incremental:
+    # previous schedules need not respect the order of interchangeable exams
+    build_options['symmetry_breaking'] = False
+metrics_file = params.get('metrics_file', '')
+explain_infeasible = params.get('explain_infeasible', True)
 
 
 #### Authorize and connect to Sheets ####
-credentials = service_account.Credentials.from_service_account_info(
-    secrets["gcp_service_account"],
-    scopes=[
-        "https://www.googleapis.com/auth/spreadsheets",
-    ],
-)
-gc = gspread.authorize(credentials)
-
-
-#### Read Google Sheets input ####
-sheet_url = secrets["private_gsheets_url"]
-workbook = gc.open_by_url(sheet_url)
-
-# Extract exams
-sheet_name = 'בחינות'
-worksheet = workbook.worksheet(sheet_name)
-data_rows = worksheet.get_all_values()[2:]
-
-exam_names = []
-exam_demands = []
-exam_index = {}
-for row_i, row in enumerate(data_rows):
-    name, demand = row[1].strip(), row[2].strip()
-    name = preprocess_name(name)
-    if name:
-        if name in exam_index:
-            log(f'Name clash in {sheet_name}, row {row_i+3}')
-
-        exam_index[name] = len(exam_names)
-        demand = int(demand)
-        exam_names.append(name)
-        exam_demands.append(demand)
-
-# Extract dates
-sheet_name = 'תאריכים'
-worksheet = workbook.worksheet(sheet_name)
-data_rows = worksheet.get_all_values()[2:]
-
-dates = []
-dates_capacity = []
-date_index = {}
-for row_i, row in enumerate(data_rows):
-    date, capacity = row[1].strip(), row[2].strip()
-    if date:
-        capacity = int(capacity) if capacity else 0
-        date_index[date] = len(dates)
-        dates.append(date)
-        dates_capacity.append(capacity)
-
-
-# Extract prescheduled constraints
-sheet_name = 'קיבועים'
-worksheet = workbook.worksheet(sheet_name)
-data_rows = worksheet.get_all_values()[2:]
-
-exam_on_date = {}
-for row_i, row in enumerate(data_rows):
-    name, date = row[1].strip(), row[2].strip()
-    if not (name and date): continue
-    
-    date = date_index.get(date)
-    if not date:
-        log(f'Invalid date in {sheet_name}, row {row_i+3}')
-        continue
-
-    name = preprocess_name(name)
-    if name:
-        if name not in exam_index:  
-            # allow defining new events in this table
-            exam_index[name] = len(exam_names)
-            exam_names.append(name)
-            # events defined here should have zero demand
-            exam_demands.append(0)
-
-        exam = exam_index.get(name)
-        exam_on_date[exam] = date
-
-    # pattern = preprocess_pattern(pattern)
-    # matches = get_matching(pattern,exam_names,exam_index)
-    # if len(matches) == 0:
-    #     log(f'Constraint in sheet {sheet_name}, row {row_i+3} yielded 0 matches')
-    #     continue
-
-    # duplicates_found = False
-    # for exam in matches: 
-    #     # detect duplicates
-    #     if exam in exam_on_date: duplicates_found = True
-    #     exam_on_date[exam] = date
-
-    # if dump_duplicates and duplicates_found:
-        # log(f'Duplicate constraint(s) detected in {sheet_name}, row {row_i+3}')
-
-
-
-# Extract minimal and ideal gap constraints
-sheet_name = 'מרווחים'
-worksheet = workbook.worksheet(sheet_name)
-data_rows = worksheet.get_all_values()[2:]
-
-min_days_between_exams = {}
-ideal_days_between_exams = {}
-weights = {}
-for row_i, row in enumerate(data_rows):
-    pattern1, pattern2, min_days, ideal_days, weight = row[1].strip(), row[2].strip(), row[3].strip(), row[4].strip(), row[5].strip()
-    if not (pattern1 and pattern2): continue
-
-    pattern1 = preprocess_pattern(pattern1)
-    pattern2 = preprocess_pattern(pattern2)
-    pairs = get_matching_pairs(pattern1,pattern2,exam_names,exam_index)
-    if len(pairs) == 0:
-        log(f'Constraint in sheet {sheet_name}, row {row_i+3} yielded 0 matches')
-
-    min_days = int(min_days) if min_days else None
-    ideal_days = int(ideal_days) if ideal_days else None
-    weight = int(weight) if weight else 1
-
-    duplicates_found = False
-    overriding = False
-    for (exam1,exam2) in pairs:
-        # ensure that exam1 < exam2 to avoid duplicates
-        if exam1 == exam2: continue
-        if exam1 > exam2: (exam1, exam2) = (exam2, exam1)
-        pair = (exam1,exam2)
-
-        # detect duplicates/overrides
-        if pair in min_days_between_exams:
-            duplicates_found = True
-            if min_days and min_days != min_days_between_exams[pair]:
-                overriding = True
-            min_days_between_exams.pop(pair, None)
-        
-        if pair in ideal_days_between_exams:
-            duplicates_found = True
-            if min_days and min_days != ideal_days_between_exams[pair]:
-                overriding = True
-            ideal_days_between_exams.pop(pair, None)
-            weights.pop(pair, None)
-
-        # update values
-        if min_days:
-            min_days_between_exams[pair] = min_days
-        if ideal_days:
-            ideal_days_between_exams[pair] = ideal_days
-            weights[pair] = weight
-    
-    if dump_duplicates and duplicates_found:
-        if overriding:
-            log(f'Duplicate constraint(s) detected in {sheet_name}, row {row_i+3} (OVERRIDING)')
-        else:
-            log(f'Duplicate constraint(s) detected in {sheet_name}, row {row_i+3} (non-overriding)')
-
-# Filter out redundant constraints
-for (pair, min_days) in min_days_between_exams.items():
-    ideal_days = ideal_days_between_exams.get(pair)
-    if ideal_days and ideal_days <= min_days: 
-        # disable constraint
-        ideal_days_between_exams[pair] = 0
-
-# Extract precedence constraints
-sheet_name = 'קדימויות'
-worksheet = workbook.worksheet(sheet_name)
-data_rows = worksheet.get_all_values()[2:]
-
-exam_before_exam = []
-for row_i, row in enumerate(data_rows):
-    pattern1, pattern2 = row[1].strip(), row[2].strip()
-    if not (pattern1 and pattern2): continue
-    
-    pattern1 = preprocess_pattern(pattern1)
-    pattern2 = preprocess_pattern(pattern2)
-    pairs = get_matching_pairs(pattern1,pattern2,exam_names,exam_index)
-    if len(pairs) == 0:
-        log(f'Constraint in sheet {sheet_name}, row {row_i+3} yielded 0 matches')
-
-    duplicates_found = False
-    for (exam1, exam2) in pairs:
-        # detect duplicates
-        if (exam1, exam2) in exam_before_exam:
-            duplicates_found = True
-            exam_before_exam.remove((exam1, exam2))
-
-        exam_before_exam.append((exam1, exam2))
-    
-    if dump_duplicates and duplicates_found:
-        log(f'Duplicate constraint(s) detected in {sheet_name}, row {row_i+3}')
-
-# exam_before_date = []
-# for row_i, row in enumerate(data_rows):
-#     exam, date = row[18], row[19]
-#     if exam and date:
-#         exam = exam_index[exam]
-#         date = date_index[date]
-#         exam_before_date.append((exam, date))
-
-# Add hints to existing solution if warmstart requested
-hints = {}
-if warm_start_prob > 0:
-    sheet_name = 'שיבוץ'
-    worksheet = workbook.worksheet(sheet_name)
-    data_rows = worksheet.get_all_values()[3:]
-    for row_i, row in enumerate(data_rows):
-        exam, date = row[1].strip(), row[2].strip()
-        if not exam or not date or not (exam in exam_index) or not (date in date_index): continue
-
-        exam_i = exam_index[exam]
-        date_i = date_index[date]
-        hints[exam_i] = date_i
-
-#### Construct scheduling problem ####
+if args.from_snapshot:
+    # no sheet access at all
+    workbook = None
+elif args.workbook:
+    workbook = FakeWorkbook.from_json(args.workbook, latency=args.workbook_latency)
+else:
+    with open(args.secrets, 'rb') as f:
+        secrets = tomllib.load(f)
+
+    with metrics.span('connect'):
+        credentials = service_account.Credentials.from_service_account_info(
+            secrets["gcp_service_account"],
+            scopes=[
+                "https://www.googleapis.com/auth/spreadsheets",
+            ],
+        )
+        gc = gspread.authorize(credentials)
+        workbook = GSheetWorkbook.open(gc, secrets["private_gsheets_url"])
+
+
+#### Read input ####
+if args.from_snapshot:
+    start_time = time.perf_counter()
+    with metrics.span('load_snapshot'):
+        instance = load_snapshot(args.from_snapshot)
+    log(f'Loaded snapshot {args.from_snapshot} in {time.perf_counter() - start_time:.3f} s')
+    cache_inputs = instance_fingerprint(instance)
+else:
+    # Fetch all input sheets in a single batched request
+    sheet_names = list(INPUT_SHEETS)
+    if warm_start_prob > 0 or incremental or warm_start_source == 'sheet':
+        sheet_names.append('שיבוץ')
+    start_time = time.perf_counter()
+    with metrics.span('fetch', sheets=len(sheet_names)) as labels:
+        sheets = workbook.read_sheets(sheet_names)
+        labels['rows'] = {name: len(rows) for name, rows in sheets.items()}
+    log(f'Read {len(sheet_names)} sheets in {time.perf_counter() - start_time:.2f} s')
+    # the previous solution only affects hints, not the model
+    cache_inputs = {name: rows for name, rows in sheets.items() if name != 'שיבוץ'}
 
-# Define the number of exams and the number of days
-num_exams = len(exam_names)
-horizon = len(dates)
-
-# Create a CP-SAT model
-model = cp_model.CpModel()
-
-# Create variables
-# exams = [model.NewIntVar(0, horizon-1, f'exam_{i}') for i in range(num_exams)]
-exams = [None] * num_exams
-for (exam_i,date_i) in exam_on_date.items():
-    exams[exam_i] = date_i
-for date_i in range(num_exams):
-    if exams[date_i] is not None: continue
-    exams[date_i] = model.NewIntVar(0, horizon-1, f'exam_{date_i}')
-
-# Create intervals for each (exam,days) pair
-gap_intervals = {}
-for (i, j), days in min_days_between_exams.items():
-    # ignore disabled constraints
-    if days < 1: continue
-    gap_intervals.setdefault((i,days), model.NewFixedSizeIntervalVar(exams[i], days, f'mingap_{i,days}'))
-    gap_intervals.setdefault((j,days), model.NewFixedSizeIntervalVar(exams[j], days, f'mingap_{j,days}'))
-
-# Add minimal gap constraints
-for (i, j), days in min_days_between_exams.items():
-    # ignore disabled constraints
-    if days < 1: continue
-    # Interval for each exam
-    # interval_i = model.NewFixedSizeIntervalVar(exams[i], days, f'mingap_{i,j}')
-    # interval_j = model.NewFixedSizeIntervalVar(exams[j], days, f'mingap_{j,i}')
-    interval_i = gap_intervals[(i,days)]
-    interval_j = gap_intervals[(j,days)]
-    model.AddNoOverlap([interval_i, interval_j])
-    # model.Add(exams[i] + min_days <= exams[j] or exams[j] + min_days <= exams[i])
-
-# Add ideal gap constraints
-ideal_violations = {}
-for (i, j), days in ideal_days_between_exams.items():
-    # ignore disabled constraints
-    if days < 1: continue
-
-    ideal_violations.setdefault((i,j), model.NewBoolVar(f'violation_{i,j}'))
-
-    # Dedicated optional intervals for each pair of exams
-    interval_i = model.NewOptionalFixedSizeIntervalVar(exams[i], days, ideal_violations[(i,j)].Not(), f'idealgap_{i,j}')
-    interval_j = model.NewOptionalFixedSizeIntervalVar(exams[j], days, ideal_violations[(i,j)].Not(), f'idealgap_{j,i}')
-    model.AddNoOverlap([interval_i, interval_j])
-
-# Add daily capacity constraints
-max_capacity = max(dates_capacity)
-exam_intervals = [model.NewFixedSizeIntervalVar(exams[i], 1, f'demand_{i}') for i in range(num_exams)]
-fake_intervals = [model.NewFixedSizeIntervalVar(t, 1, f'fake_demand_{t}') for t in range(horizon)]
-all_intervals = exam_intervals + fake_intervals
-all_demands = exam_demands + [max_capacity - c for c in dates_capacity]
-model.AddCumulative(all_intervals, all_demands, max_capacity)
-
-# Add precedence constraints
-for (i,j) in exam_before_exam:
-    model.Add(exams[i] <= exams[j])
-
-# # Add prescheduling constraints
-# for (i,t) in exam_on_date.items():
-#     model.Add(exams[i] == t)
-
-
-
-
-# Define the objective
-
-# Minimize soft constraints violation
-# model.Minimize( sum(ideal_violations.values()) )
-
-# Minimize soft constraints weighted violation
-keys = ideal_violations.keys()
-expr = [ideal_violations[k] for k in keys]
-coef = [weights[k] for k in keys]
-model.Minimize(cp_model.LinearExpr.WeightedSum(expr,coef))
-
-# # Define the objective: makespan
-# makespan = model.NewIntVar(0, horizon, 'makespan')
-# model.AddMaxEquality(makespan, exams)
-# model.Minimize(makespan)
 
+#### Construct scheduling problem ####
+model_cache = ModelCache(model_cache_dir, model_cache_entries) if model_cache_dir else None
+cache_key = model_cache_key(cache_inputs, build_options)
+with metrics.span('cache_load'):
+    cached = model_cache.load(cache_key) if model_cache else None
+
+if cached:
+    cached_instance, model, exams, ideal_violations, auxiliary, build_log = cached
+    if not args.from_snapshot:
+        instance = cached_instance
+        if 'שיבוץ' in sheets:
+            instance.hints = parse_hints(sheets['שיבוץ'], instance)
+    log(f'Loaded cached model {cache_key[:12]}')
+    # warnings about the input are logged on every run, not just the first
+    for line in build_log:
+        log(line)
+else:
+    # lines logged while parsing and building, kept with the cached model
+    build_log = []
+    def log_build(line):
+        build_log.append(line)
+        log(line)
+
+    if not args.from_snapshot:
+        with metrics.span('parse'):
+            instance = parse_instance(sheets, log_build, dump_duplicates, metrics)
+    with metrics.span('build'):
+        model, exams, ideal_violations, auxiliary = build_model(instance, build_options, log_build)
+    if model_cache:
+        with metrics.span('cache_store'):
+            model_cache.store(cache_key, instance, model, exams, ideal_violations, auxiliary, build_log)
+
+if args.save_snapshot:
+    save_snapshot(args.save_snapshot, instance)
+    log(f'Saved snapshot to {args.save_snapshot}')
+
+exam_names = instance.exam_names
+dates = instance.dates
+parsed_dates = parse_dates(dates)
+exam_on_date = instance.exam_on_date
+min_days_between_exams = instance.min_days_between_exams
+ideal_days_between_exams = instance.ideal_days_between_exams
+hints = instance.hints
+num_exams = instance.num_exams
+evaluator = ScheduleEvaluator(instance)
+
+
+
+# Restrict the problem to exams affected by changes, if incremental mode requested
+solve_model = model
+if incremental:
+    previous = hints
+    if not previous and os.path.exists('schedule.csv'):
+        previous = read_schedule_csv('schedule.csv', instance)
+
+    if previous and os.path.exists('schedule.npz'):
+        previous_instance = load_snapshot('schedule.npz')
+        with metrics.span('restrict'):
+            reopened, changed = reopened_exams(previous_instance, instance, previous, incremental_radius)
+            solve_model = restrict_model(model, exams, previous, reopened, incremental_mode)
+        log(f'Incremental mode: reopened {len(reopened)} of {num_exams} exams ({len(changed)} touched by changes, radius {incremental_radius})')
+    else:
+        log('Incremental mode: no previous schedule found, solving all exams')
 
 # Add hints if warmstart requested
-if warm_start_prob > 0:
+# complete schedule hinted to the solver, and where it comes from
+warm_schedule = None
+hint_label = None
+if warm_start_source and solve_model is model:
+    # hint every exam (and violation literal) from the previous schedule
+    if warm_start_source == 'csv':
+        previous = read_schedule_csv('schedule.csv', instance) if os.path.exists('schedule.csv') else {}
+    else:
+        previous = hints
+
+    if previous:
+        warm_schedule, repaired, unplaced = repair_schedule(instance, previous)
+        hint_label = 'Warm start'
+        if build_options['symmetry_breaking']:
+            warm_schedule = order_symmetric_values(symmetry_classes(instance), warm_schedule)
+        num_hints = add_full_hints(model, exams, ideal_violations, auxiliary, instance, warm_schedule)
+        log(f'Warm start from {warm_start_source}: {len(previous)} of {num_exams} exams previously scheduled, '
+            f'{len(repaired)} moved or added to meet hard constraints, {len(unplaced)} without a consistent date '
+            f'({num_hints} variables hinted)')
+        if len(warm_schedule) == num_exams:
+            log(f'Warm start: hinted objective value = {weighted_violations(instance, [warm_schedule[i] for i in range(num_exams)])}')
+        if unplaced:
+            log('Warm start: no consistent date for ' + ', '.join(exam_names[i] for i in unplaced[:10]) +
+                (', ...' if len(unplaced) > 10 else ''))
+    else:
+        log(f'Warm start: no previous schedule found in {warm_start_source}')
+
+elif warm_start_prob > 0 and solve_model is model:
+    if build_options['symmetry_breaking']:
+        # swap hinted dates of interchangeable exams into the enforced order
+        hints = order_symmetric_values(symmetry_classes(instance), hints)
     for (exam_i,date_i) in hints.items():
         # include hints at random
         if not (exam_i in exam_on_date) and random.random() < warm_start_prob:
             model.AddHint(exams[exam_i], date_i)
 
-    # for (pair,bool_var) in ideal_violations.items():
-    #     exam_i, exam_j = pair
-    #     if exam_i == 0 or exam_j == 0: continue
 
-    #     date_i, date_j = hints[exam_i], hints[exam_j]
-    #     gap = abs(date_i - date_j)
-    #     # min_days = min_days_between_exams.get(pair,'')
-    #     ideal_days = ideal_days_between_exams.get(pair,None)
-    #     if ideal_days:
-    #         model.AddHint(bool_var, gap <= ideal_days)
+elif heuristic_time_in_secs > 0 and solve_model is model:
+    # hint every exam from a greedy and local-search schedule
+    start_time = time.perf_counter()
+    with metrics.span('heuristic'):
+        warm_schedule, breaches, objective, search = heuristic_schedule(instance, heuristic_time_in_secs)
+    hint_label = 'Heuristic'
+    if build_options['symmetry_breaking']:
+        warm_schedule = order_symmetric_values(symmetry_classes(instance), warm_schedule)
+    num_hints = add_full_hints(model, exams, ideal_violations, auxiliary, instance, warm_schedule)
+    log(f'Heuristic: objective value {objective} (greedy {search.greedy_objective}), '
+        f'{breaches} hard constraints broken, {search.iterations} local search steps in '
+        f'{time.perf_counter() - start_time:.1f} s ({num_hints} variables hinted)')
+
+# Export the model as solved (with hints), for replay.py
+if export_model_dir:
+    export_model(export_model_dir, solve_model, exams, ideal_violations, exam_names,
+                 {'time_limit': time_limit_in_mins * 60.0, 'absolute_gap_limit': absolute_gap_limit,
+                  'build_options': build_options, 'params': params})
+    log(f'Exported model to {export_model_dir}')
 
 
 # Create a solver and solve the model
-solver = cp_model.CpSolver()
-# Set solver parameters
-if time_limit_in_mins > 0:
-    solver.parameters.max_time_in_seconds = time_limit_in_mins * 60.0
-if absolute_gap_limit > 0:
-    solver.parameters.absolute_gap_limit = absolute_gap_limit
-if debug:
-    solver.parameters.log_search_progress = True
-    solver.log_callback = print
+def save_incumbent_values(values):
+    write_solution_to_csv('schedule.csv', extract_solution_from_values(values, exam_names, parsed_dates))
+
+def stream_incumbent_values(values):
+    # push the incumbent and the log to the sheets while the solver runs
+    solution = extract_solution_from_values(values, exam_names, parsed_dates)
+    violations = evaluator.violations(values, exam_names)
+    write_solution_to_gsheet(workbook.worksheet('שיבוץ'), solution, violations)
+    write_log_to_gsheet(workbook.worksheet('log'), list(logger))
+
+def solve(model):
+    # incumbents are saved (and streamed) by background threads, at most once
+    # per interval, so that neither slows down the search
+    writers = []
+    def start_writers():
+        writers.append(BackgroundWriter(save_incumbent_values, save_interval_in_secs,
+                                        on_error=lambda e: log(f'Failed to save incumbent: {e}')))
+        if stream_interval_in_secs > 0 and workbook is not None:
+            writers.append(BackgroundWriter(stream_incumbent_values, stream_interval_in_secs,
+                                            on_error=lambda e: log(f'Failed to stream incumbent: {e}')))
+    try:
+        if portfolio_size > 0:
+            # (the writer threads start once the portfolio has forked its workers)
+            return solve_with_portfolio(model, writers, start_writers)
+        start_writers()
+        return solve_with_solver(model, writers)
+    finally:
+        # write the last incumbent before the final solution is saved
+        for writer in writers:
+            writer.close()
+
+def solve_with_portfolio(model, writers, on_start):
+    def save_incumbent(result):
+        metrics.record_solution(result.WallTime(), result.ObjectiveValue(), result.BestObjectiveBound())
+        values = [result.Value(x) for x in exams]
+        for writer in writers:
+            writer.submit(values)
+
+    # (the members' logs stay in their processes, so presolve is not split out)
+    with metrics.span('solve', portfolio=portfolio_size):
+        result = solve_portfolio(model, portfolio_configs(portfolio_size),
+                                 time_limit=time_limit_in_mins * 60.0,
+                                 absolute_gap_limit=absolute_gap_limit,
+                                 on_improvement=save_incumbent,
+                                 log=log,
+                                 on_start=on_start,
+                                 watched=exams)
+    return result.status, result
+
+def solve_with_solver(model, writers):
+    solver = cp_model.CpSolver()
+    # Set solver parameters
+    if time_limit_in_mins > 0:
+        solver.parameters.max_time_in_seconds = time_limit_in_mins * 60.0
+    if absolute_gap_limit > 0:
+        solver.parameters.absolute_gap_limit = absolute_gap_limit
+    # the solver log tells where presolve ends and search starts
+    log_timer = SolverLogTimer(print if debug else None) if metrics_file else None
+    if debug or log_timer:
+        solver.parameters.log_search_progress = True
+        solver.parameters.log_to_stdout = False
+        solver.log_callback = log_timer or print
+
+    solution_callback = MySolutionCallback(exams, writers, log, metrics)
+    solve_start = metrics.now()
+    status = solver.SolveWithSolutionCallback(model, solution_callback)
+    if log_timer:
+        log_timer.add_spans(metrics, solve_start, solver.WallTime())
+    return status, solver
 
 # Solve!
-log(f'Solving scheduling problem (time_limit_in_mins={time_limit_in_mins}, absolute_gap_limit={absolute_gap_limit})...')
+if portfolio_size > 0:
+    log(f'Solving scheduling problem with a portfolio of {portfolio_size} solvers (time_limit_in_mins={time_limit_in_mins}, absolute_gap_limit={absolute_gap_limit})...')
+else:
+    log(f'Solving scheduling problem (time_limit_in_mins={time_limit_in_mins}, absolute_gap_limit={absolute_gap_limit})...')
+
+status, solver = solve(solve_model)
 
-solution_callback = MySolutionCallback(exams, exam_names, dates, log)
-status = solver.SolveWithSolutionCallback(model, solution_callback)
+if status == cp_model.INFEASIBLE and solve_model is not model:
+    # the changes cannot be accommodated around the previous schedule
+    log('Incremental subproblem is infeasible, reopening all exams')
+    solve_model = restrict_model(model, exams, previous, set(range(num_exams)))
+    status, solver = solve(solve_model)
 
 log(f'Solver finished in {solver.WallTime()} s')
 # status = solver.Solve(model)
@@ -520,64 +463,84 @@ success = (status in [cp_model.OPTIMAL, cp_model.FEASIBLE])
 status_name = solver.StatusName(status)
 log(f'Solver status: {status_name}')
 
+if status == cp_model.INFEASIBLE and explain_infeasible:
+    # name the sheet rows that conflict
+    explain_instance = instance
+    if not instance.rows and not args.from_snapshot:
+        # cached instances do not keep sheet rows
+        explain_instance = parse_instance(sheets, lambda line: None)
+    with metrics.span('explain'):
+        _, _, conflict = explain_infeasibility(explain_instance, time_limit_in_mins*60, log)
+    for group, keys in conflict:
+        log(f'Explain: {describe_conflict(explain_instance, group, keys)}')
 
-#### Save solution to the Google Sheet ####
-
-# Write log to 'log' sheet
-log_sheet = workbook.worksheet('log')
-start_row = 1
-end_row = log_sheet.row_count
-range_name = f'A{start_row}:A{end_row}'
-log_sheet.batch_clear([range_name])
-
-log_sheet.update(range_name=range_name,
-                 values=[logger], 
-                 major_dimension='COLUMNS',
-                 value_input_option="USER_ENTERED")
 
 if success:
     # extract solution
-    solution = extract_solution_from_solver(solver,exams,exam_names,dates)
-    failed_list = extract_violations_from_solver(solver, ideal_violations, exams, exam_names, ideal_days_between_exams)
-
-    # Write/backup solution to local csv file
-    write_solution_to_csv('schedule.csv', solution)
-
-    # Write output to 'שיבוץ' worksheet
-    output = workbook.worksheet('שיבוץ')
-    write_solution_to_gsheet(output, solution, failed_list)
-
-
-if success and dump_stats:
-    # calculate all gaps
-    all_pairs = sorted( set().union(min_days_between_exams.keys(), ideal_days_between_exams.keys()) )
-    
-    data = []
-    for pair in all_pairs:
-        exam1, exam2 = pair
-        name1, name2 = exam_names[exam1], exam_names[exam2]
-        date1, date2 = solution.get(name1), solution.get(name2)
-        if date1 is None or date2 is None: continue
-        
-        # actual_gap = abs((date1-date2).days)
-        min_days = min_days_between_exams.get(pair,'')
-        ideal_days = ideal_days_between_exams.get(pair,'')
-        ideal_days = '' if ideal_days == 0 else ideal_days
+    values = [solver.Value(x) for x in exams]
+    solution = extract_solution_from_values(values,exam_names,parsed_dates)
+    failed_list = evaluator.violations(values, exam_names)
+
+    # validate the schedule independently of the model
+    evaluation = evaluator.evaluate(values)
+    for line in evaluator.describe_breaches(values):
+        log(f'Validation: {line}')
+    peak_load = max(load / capacity for load, capacity in zip(evaluation.load[0], evaluator.capacity) if capacity)
+    log(f'Validation: objective {evaluation.objective[0]}, {len(failed_list)} ideal gaps violated, '
+        f'peak load {peak_load:.0%} of capacity')
+
+    if warm_schedule is not None:
+        kept = sum(solver.Value(exams[i]) == t for i, t in warm_schedule.items())
+        log(f'{hint_label}: the schedule keeps {kept} of {len(warm_schedule)} hinted dates')
+
+    with metrics.span('save'):
+        # Write/backup solution to local csv file
+        write_solution_to_csv('schedule.csv', solution)
 
-        # actual gap will be computed by the spreadsheet
-        # data.append([name1,name2,min_days,ideal_days,actual_gap])
-        data.append([name1,name2,min_days,ideal_days])
+        # Save the instance behind this solution, for incremental re-solves
+        assignment = {i: int(values[i]) for i in range(num_exams)}
+        save_snapshot('schedule.npz', dataclasses.replace(instance, hints=assignment))
 
-    # Write output to 'debug' worksheet
-    debug_sheet = workbook.worksheet('stats')
 
-    # Clear existing content starting from row start_row
-    start_row = 3
-    end_row = debug_sheet.row_count
-    debug_sheet.batch_clear([f'B{start_row}:E{end_row}'])
-
-    # Write data
-    debug_sheet.update(range_name=f'B{start_row}:E{start_row+len(data)-1}',
-                  values=data, 
-                  value_input_option="USER_ENTERED")
-    
\ No newline at end of file
+#### Save solution to the Google Sheet ####
+# (runs from a snapshot have no sheet to write to)
+if workbook is not None:
+
+    # Write log to 'log' sheet
+    with metrics.span('write', sheet='log'):
+        write_log_to_gsheet(workbook.worksheet('log'), logger)
+
+    if success:
+        # Write output to 'שיבוץ' worksheet
+        with metrics.span('write', sheet='שיבוץ'):
+            output = workbook.worksheet('שיבוץ')
+            write_solution_to_gsheet(output, solution, failed_list)
+
+
+    if success and dump_stats:
+        # all gaps (the actual gap is computed by the spreadsheet)
+        pairs, min_days, ideal_days = evaluator.pair_table()
+        data = []
+        for (exam1, exam2), min_gap, ideal_gap in zip(pairs.tolist(), min_days.tolist(), ideal_days.tolist()):
+            name1, name2 = exam_names[exam1], exam_names[exam2]
+            if name1 not in solution or name2 not in solution: continue
+            data.append([name1, name2, min_gap or '', ideal_gap or ''])
+
+        # Write output to 'debug' worksheet
+        with metrics.span('write', sheet='stats'):
+            debug_sheet = workbook.worksheet('stats')
+
+            # Clear existing content starting from row start_row
+            start_row = 3
+            end_row = debug_sheet.row_count
+            debug_sheet.batch_clear([f'B{start_row}:E{end_row}'])
+
+            # Write data
+            debug_sheet.update(range_name=f'B{start_row}:E{start_row+len(data)-1}',
+                          values=data, 
+                          value_input_option="USER_ENTERED")
+
+
+#### Save run metrics ####
+if metrics_file:
+    metrics.write(metrics_file)
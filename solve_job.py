@@ -0,0 +1,68 @@
+import time
+import threading
+from ortools.sat.python import cp_model
+from persistence import solution_reader
+
+#### Background solve ####
+# A CP-SAT solve running on its own thread, whose progress (objective and
+# bound over time, and the latest values of watched variables) can be read
+# from another thread, e.g. by a Streamlit page that reruns periodically.
+
+class _ProgressCallback(cp_model.CpSolverSolutionCallback):
+    def __init__(self, job, watched):
+        cp_model.CpSolverSolutionCallback.__init__(self)
+        self.__job = job
+        self.__read_values = solution_reader(watched)
+
+    def on_solution_callback(self):
+        self.__job.watched_values = self.__read_values(self.Response().solution)
+        self.__job.progress.append((self.WallTime(), self.ObjectiveValue(), self.BestObjectiveBound()))
+
+
+class SolveJob:
+    """Solves `model` on a background thread.
+
+    `progress` lists (wall time, objective, best bound) per solution, and
+    `watched_values` holds the values of `watched` in the latest solution.
+    Once `done()`, `status` and `solver` give the result; cancelling stops the
+    search, keeping the best solution found so far."""
+
+    def __init__(self, model, time_limit=0, watched=()):
+        self.model = model
+        self.solver = cp_model.CpSolver()
+        if time_limit > 0:
+            self.solver.parameters.max_time_in_seconds = time_limit
+        self.progress = []
+        self.watched_values = None
+        self.status = None
+        self.cancelled = False
+        self.error = None
+        self.start_time = None
+        self.__callback = _ProgressCallback(self, list(watched))
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+
+    def start(self):
+        self.start_time = time.monotonic()
+        self.__thread.start()
+        return self
+
+    def __run(self):
+        try:
+            self.status = self.solver.SolveWithSolutionCallback(self.model, self.__callback)
+        except Exception as e:
+            self.error = e
+            self.status = cp_model.MODEL_INVALID
+
+    def done(self):
+        return self.status is not None
+
+    def elapsed(self):
+        return time.monotonic() - self.start_time if self.start_time is not None else 0.0
+
+    def cancel(self):
+        self.cancelled = True
+        self.solver.StopSearch()
+
+    def wait(self, timeout=None):
+        self.__thread.join(timeout)
+        return self.done()
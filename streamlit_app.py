@@ -3,73 +3,53 @@ import gspread
 # from openpyxl.utils.cell import get_column_letter
 from ortools.sat.python import cp_model
 from google.oauth2 import service_account
-import re
+from patterns import preprocess_name, preprocess_pattern, NameMatcher
+from workbook import GSheetWorkbook, values_hash
+from solve_job import SolveJob
 from datetime import datetime
 from zoneinfo import ZoneInfo
-# import time
-
-#### regex helper functions ####
-def preprocess_name(name):
-    # strip consecutive whitespaces
-    name = re.sub(' +', ' ', name)
-    return name
-
-def preprocess_pattern(pattern):
-    # strip consecutive whitespaces
-    pattern = re.sub(' +', ' ', pattern)
-    # use '#' as a wildcard character (in addition to '.')
-    pattern = pattern.replace('#', '.')
-    return pattern
-
-def get_matching(pattern, names, index):
-    return [index[name] for name in names if re.fullmatch(pattern,name)]
-
-def get_matching_pairs(pattern1, pattern2, names, index):
-    matches = get_matching(pattern1,names,index)
-    subs = [re.sub(pattern1,pattern2,names[i]) for i in matches]
-
-    pairs = []
-    for i1,sub in zip(matches,subs):
-        for i2 in get_matching(sub,names,index):
-            if i1 != i2: pairs.append((i1,i2))
-    return pairs
-
+import time
 
 #### Authorize and connect to Sheets ####
-credentials = service_account.Credentials.from_service_account_info(
-    st.secrets["gcp_service_account"],
-    scopes=[
-        "https://www.googleapis.com/auth/spreadsheets",
-    ],
-)
-gc = gspread.authorize(credentials)
+# (shared by all sessions and reruns; gspread refreshes the token as needed)
+@st.cache_resource
+def get_client():
+    credentials = service_account.Credentials.from_service_account_info(
+        st.secrets["gcp_service_account"],
+        scopes=[
+            "https://www.googleapis.com/auth/spreadsheets",
+        ],
+    )
+    return gspread.authorize(credentials)
 
+@st.cache_resource
+def open_workbook(sheet_url):
+    return GSheetWorkbook.open(get_client(), sheet_url)
 
-#### Hello ####
 
-st.title('Exam scheduler 2024a')
+#### Helpers ####
+class WarningLog:
+    # collects warnings, so they can be shown again on every rerun of the page
+    def __init__(self):
+        self.messages = []
 
-st.write('Enter data in spreadsheet:')
-st.write(st.secrets["private_gsheets_url"])
-
-time_limit_mins = st.slider('Time limit (minutes):', min_value=1, max_value=60, value=1, step=1)
-
-if not st.button("Process!"):
-    st.stop()
+    def warning(self, message, icon=None):
+        self.messages.append(message)
 
 
 #### Read Google Sheets input ####
-message = "reading data from spreadsheet"
-with st.spinner(text=message.capitalize() + '...'):
-    log = st.expander("Log", expanded=False)
+INPUT_SHEETS = ['בחינות', 'תאריכים', 'מרווחים', 'קדימויות', 'קיבועים']
 
-    # pbar = st.progress(20, text="Reading data from spreadsheet...")
-    sheet_url = st.secrets["private_gsheets_url"]
-    workbook = gc.open_by_url(sheet_url)
+# Parsing (pattern expansion in particular) is cached by a hash of the fetched
+# values, so it is skipped when the input sheets have not changed
+@st.cache_data(max_entries=8, show_spinner=False)
+def parse_input_cached(sheets_hash, _sheets):
+    log = WarningLog()
+    return parse_input(_sheets, log), log.messages
 
+def parse_input(sheets, log):
     # Extract exams
-    worksheet = workbook.worksheet('בחינות')
-    data_rows = worksheet.get_all_values()[2:]
+    data_rows = sheets['בחינות'][2:]
 
     exam_names = []
     exam_demands = []
@@ -87,8 +67,7 @@ with st.spinner(text=message.capitalize() + '...'):
     # pbar.progress(20)
 
     # Extract dates
-    worksheet = workbook.worksheet('תאריכים')
-    data_rows = worksheet.get_all_values()[2:]
+    data_rows = sheets['תאריכים'][2:]
 
     dates = []
     dates_capacity = []
@@ -104,10 +83,12 @@ with st.spinner(text=message.capitalize() + '...'):
     # st.write([(date, capacity) for date, capacity in zip(dates, dates_capacity)])
     # pbar.progress(40)
 
+    # Index exam names for pattern expansion
+    matcher = NameMatcher(exam_names, exam_index)
+
     # Extract minimal and ideal gap constraints
     sheet_name = 'מרווחים'
-    worksheet = workbook.worksheet(sheet_name)
-    data_rows = worksheet.get_all_values()[2:]
+    data_rows = sheets[sheet_name][2:]
 
     min_days_between_exams = {}
     ideal_days_between_exams = {}
@@ -117,7 +98,7 @@ with st.spinner(text=message.capitalize() + '...'):
 
         pattern1 = preprocess_pattern(pattern1)
         pattern2 = preprocess_pattern(pattern2)
-        pairs = get_matching_pairs(pattern1,pattern2,exam_names,exam_index)
+        pairs = matcher.matching_pairs(pattern1,pattern2)
         if len(pairs) == 0:
             log.warning(f'Constraint in sheet {sheet_name}, row {row_i+3} yielded 0 matches', icon="⚠️")
         # st.write(f'found matching pairs for gap constraints: {pairs}')
@@ -166,8 +147,7 @@ with st.spinner(text=message.capitalize() + '...'):
 
     # Extract precedence constraints
     sheet_name = 'קדימויות'
-    worksheet = workbook.worksheet(sheet_name)
-    data_rows = worksheet.get_all_values()[2:]
+    data_rows = sheets[sheet_name][2:]
 
     exam_before_exam = []
     for row_i, row in enumerate(data_rows):
@@ -176,7 +156,7 @@ with st.spinner(text=message.capitalize() + '...'):
         
         pattern1 = preprocess_pattern(pattern1)
         pattern2 = preprocess_pattern(pattern2)
-        pairs = get_matching_pairs(pattern1,pattern2,exam_names,exam_index)
+        pairs = matcher.matching_pairs(pattern1,pattern2)
         if len(pairs) == 0:
             log.warning(f'Constraint in sheet {sheet_name}, row {row_i+3} yielded 0 matches', icon="⚠️")
         # st.write(f'found {len(pairs)} matching pairs for precedence constraints')
@@ -207,8 +187,7 @@ with st.spinner(text=message.capitalize() + '...'):
 
     # Extract prescheduled constraints
     sheet_name = 'קיבועים'
-    worksheet = workbook.worksheet(sheet_name)
-    data_rows = worksheet.get_all_values()[2:]
+    data_rows = sheets[sheet_name][2:]
 
     exam_on_date = []
     for row_i, row in enumerate(data_rows):
@@ -216,7 +195,7 @@ with st.spinner(text=message.capitalize() + '...'):
         if not (pattern and date): continue
 
         pattern = preprocess_pattern(pattern)
-        matches = get_matching(pattern,exam_names,exam_index)
+        matches = matcher.matching(pattern)
         if len(matches) == 0:
             log.warning(f'Constraint in sheet {sheet_name}, row {row_i+3} yielded 0 matches', icon="⚠️")
         # st.write(f'found {len(matches)} matches for prescheduled constraints')
@@ -234,118 +213,188 @@ with st.spinner(text=message.capitalize() + '...'):
         if duplicates_found:
             log.warning(f'Duplicate constraint(s) detected in {sheet_name}, row {row_i+3}', icon="⚠️")
 
-st.success('Done ' + message)
+    return (exam_names, exam_demands, dates, dates_capacity,
+            min_days_between_exams, ideal_days_between_exams, exam_before_exam, exam_on_date)
 
 
 #### Construct scheduling problem ####
-# message = f'solving scheduling problem (limiting to {time_limit_mins}m)'
-# with st.progress(0, text=message.capitalize() + '...') as pbar:
+def build_scheduling_model(num_exams, exam_demands, dates_capacity, min_days_between_exams,
+                           ideal_days_between_exams, exam_before_exam, exam_on_date):
+    # Define the number of days
+    horizon = len(dates_capacity)
+
+    # Create a CP-SAT model
+    model = cp_model.CpModel()
+
+    # Create variables
+    exams = [model.NewIntVar(0, horizon-1, f'exam_{i}') for i in range(num_exams)]
+
+    # Add minimal gap constraints
+    for (i, j), days in min_days_between_exams.items():
+        # ignore disabled constraints
+        if days < 1: continue
+
+        # Interval for each exam
+        interval_i = model.NewFixedSizeIntervalVar(exams[i], days, f'mingap_{i,j}')
+        interval_j = model.NewFixedSizeIntervalVar(exams[j], days, f'mingap_{j,i}')
+        model.AddNoOverlap([interval_i, interval_j])
+        # model.Add(exams[i] + min_days <= exams[j] or exams[j] + min_days <= exams[i])
+
+    # Add ideal gap constraints
+    ideal_bools = {}
+    for (i, j), days in ideal_days_between_exams.items():
+        # ignore disabled constraints
+        if days < 1: continue
+
+        b = model.NewBoolVar(f'idealbool_{i,j}')
+        ideal_bools[(i,j)] = b
+
+        # Interval for each exam
+        interval_i = model.NewOptionalFixedSizeIntervalVar(exams[i], days, b, f'idealgap_{i,j}')
+        interval_j = model.NewOptionalFixedSizeIntervalVar(exams[j], days, b, f'idealgap_{j,i}')
+        model.AddNoOverlap([interval_i, interval_j])
+
+    # Add daily capacity constraints
+    max_capacity = max(dates_capacity)
+    exam_intervals = [model.NewFixedSizeIntervalVar(exams[i], 1, f'demand_{i}') for i in range(num_exams)]
+    fake_intervals = [model.NewFixedSizeIntervalVar(t, 1, f'fake_demand_{t}') for t in range(horizon)]
+    all_intervals = exam_intervals + fake_intervals
+    all_demands = exam_demands + [max_capacity - c for c in dates_capacity]
+    model.AddCumulative(all_intervals, all_demands, max_capacity)
+
+    # Add precedence constraints
+    for (i,j) in exam_before_exam:
+        model.Add(exams[i] < exams[j])
+    # for (i,t) in exam_before_date:
+    #     model.Add(exams[i] < t)
+
+    # Add prescheduling constraints
+    for (i,t) in exam_on_date:
+        model.Add(exams[i] == t)
+
+
+    # # Define the objective: minimize collisions
+    # collisions = []
+    # for i in range(num_exams):
+    #     for j in range(num_exams):
+    #         b = model.NewBoolVar(f'{i}{j}')
+    #         model.Add(exams[i]==exams[j]).OnlyEnforceIf(b)
+    #         model.Add(exams[i]!=exams[j]).OnlyEnforceIf(b.Not())
+    #         collisions.append(b)
+
+    # factor = num_exams**2
+    # if len(ideal_bools) > 0:
+    #     # Minimize collisions, but prioritize soft constraints
+    #     model.Minimize( -factor * sum(ideal_bools.values()) + sum(collisions) )
+    # else:
+    #     # Minimize collisions
+    #     model.Minimize( sum(collisions) )
+
+    # Define the objective: maximize soft constraints satisfaction
+    model.Maximize( sum(ideal_bools.values()) )
+
+    # # Define the objective: makespan
+    # makespan = model.NewIntVar(0, horizon, 'makespan')
+    # model.AddMaxEquality(makespan, exams)
+    # model.Minimize(makespan)
+
+    return model, exams, ideal_bools
+
 
-# Define the number of exams and the number of days
+#### Hello ####
+
+st.title('Exam scheduler 2024a')
+
+st.write('Enter data in spreadsheet:')
+st.write(st.secrets["private_gsheets_url"])
+
+time_limit_mins = st.slider('Time limit (minutes):', min_value=1, max_value=60, value=1, step=1)
+
+# The solve runs in a background thread that outlives the script run; the page
+# reruns every second to show its progress, until it finishes or is cancelled
+job = st.session_state.get('job')
+process = st.button("Process!", disabled=job is not None and not job.done())
+
+if process:
+    message = "reading data from spreadsheet"
+    with st.spinner(text=message.capitalize() + '...'):
+        sheet_url = st.secrets["private_gsheets_url"]
+        workbook = open_workbook(sheet_url)
+        # Fetch all input sheets in a single batched request
+        sheets = workbook.read_sheets(INPUT_SHEETS)
+        sheets_hash = values_hash(sheets)
+        unchanged = sheets_hash == st.session_state.get('sheets_hash')
+        st.session_state['sheets_hash'] = sheets_hash
+        (exam_names, exam_demands, dates, dates_capacity, min_days_between_exams,
+         ideal_days_between_exams, exam_before_exam, exam_on_date), warnings = parse_input_cached(sheets_hash, sheets)
+
+    model, exams, ideal_bools = build_scheduling_model(len(exam_names), exam_demands, dates_capacity,
+                                                       min_days_between_exams, ideal_days_between_exams,
+                                                       exam_before_exam, exam_on_date)
+
+    # Solve in the background
+    job = SolveJob(model, time_limit_mins * 60.0, watched=list(ideal_bools.values()))
+    st.session_state['job'] = job
+    st.session_state['run'] = {
+        'workbook': workbook,
+        'warnings': warnings,
+        'unchanged': unchanged,
+        'time_limit_mins': time_limit_mins,
+        'exam_names': exam_names,
+        'dates': dates,
+        'ideal_days_between_exams': ideal_days_between_exams,
+        'exams': exams,
+        'ideal_bools': ideal_bools,
+        'output_written': False,
+    }
+    job.start()
+
+if job is None:
+    st.stop()
+
+run = st.session_state['run']
+workbook = run['workbook']
+exam_names, dates, exams = run['exam_names'], run['dates'], run['exams']
+ideal_days_between_exams, ideal_bools = run['ideal_days_between_exams'], run['ideal_bools']
 num_exams = len(exam_names)
-horizon = len(dates)
-
-# Create a CP-SAT model
-model = cp_model.CpModel()
-
-# Create variables
-exams = [model.NewIntVar(0, horizon-1, f'exam_{i}') for i in range(num_exams)]
-
-# Add minimal gap constraints
-for (i, j), days in min_days_between_exams.items():
-    # ignore disabled constraints
-    if days < 1: continue
-
-    # Interval for each exam
-    interval_i = model.NewFixedSizeIntervalVar(exams[i], days, f'mingap_{i,j}')
-    interval_j = model.NewFixedSizeIntervalVar(exams[j], days, f'mingap_{j,i}')
-    model.AddNoOverlap([interval_i, interval_j])
-    # model.Add(exams[i] + min_days <= exams[j] or exams[j] + min_days <= exams[i])
-
-# Add ideal gap constraints
-ideal_bools = {}
-for (i, j), days in ideal_days_between_exams.items():
-    # ignore disabled constraints
-    if days < 1: continue
-
-    b = model.NewBoolVar(f'idealbool_{i,j}')
-    ideal_bools[(i,j)] = b
-
-    # Interval for each exam
-    interval_i = model.NewOptionalFixedSizeIntervalVar(exams[i], days, b, f'idealgap_{i,j}')
-    interval_j = model.NewOptionalFixedSizeIntervalVar(exams[j], days, b, f'idealgap_{j,i}')
-    model.AddNoOverlap([interval_i, interval_j])
-
-# Add daily capacity constraints
-max_capacity = max(dates_capacity)
-exam_intervals = [model.NewFixedSizeIntervalVar(exams[i], 1, f'demand_{i}') for i in range(num_exams)]
-fake_intervals = [model.NewFixedSizeIntervalVar(t, 1, f'fake_demand_{t}') for t in range(horizon)]
-all_intervals = exam_intervals + fake_intervals
-all_demands = exam_demands + [max_capacity - c for c in dates_capacity]
-model.AddCumulative(all_intervals, all_demands, max_capacity)
-
-# Add precedence constraints
-for (i,j) in exam_before_exam:
-    model.Add(exams[i] < exams[j])
-# for (i,t) in exam_before_date:
-#     model.Add(exams[i] < t)
-
-# Add prescheduling constraints
-for (i,t) in exam_on_date:
-    model.Add(exams[i] == t)
-
-
-# # Define the objective: minimize collisions
-# collisions = []
-# for i in range(num_exams):
-#     for j in range(num_exams):
-#         b = model.NewBoolVar(f'{i}{j}')
-#         model.Add(exams[i]==exams[j]).OnlyEnforceIf(b)
-#         model.Add(exams[i]!=exams[j]).OnlyEnforceIf(b.Not())
-#         collisions.append(b)
-
-# factor = num_exams**2
-# if len(ideal_bools) > 0:
-#     # Minimize collisions, but prioritize soft constraints
-#     model.Minimize( -factor * sum(ideal_bools.values()) + sum(collisions) )
-# else:
-#     # Minimize collisions
-#     model.Minimize( sum(collisions) )
-
-# Define the objective: maximize soft constraints satisfaction
-model.Maximize( sum(ideal_bools.values()) )
-
-# # Define the objective: makespan
-# makespan = model.NewIntVar(0, horizon, 'makespan')
-# model.AddMaxEquality(makespan, exams)
-# model.Minimize(makespan)
-
-# Create a solver and solve the model
-solver = cp_model.CpSolver()
-# Sets a time limit
-solver.parameters.max_time_in_seconds = time_limit_mins * 60.0
-
-# Start progressbar
-# message = f'solving scheduling problem (limiting to {time_limit_mins}m)'
-# pbar = st.progress(0, text=message.capitalize() + '...')
-# st.session_state["counter"] = 0.0
-
-# async def timer(pbar):
-#     while True:
-#         progress = st.session_state["counter"]
-#         pbar.progress(progress, text=message.capitalize() + '...')
-#         if progress == 1.0: return
-
-#         incr = 1.0/(time_limit_mins * 60.0)
-#         st.session_state["counter"] = min(progress+incr,1.0)
-#         r = await asyncio.sleep(1)
-
-# asyncio.run(timer(pbar))
-
-# Solve!
-message = f'solving scheduling problem (limiting to {time_limit_mins}m)'
-with st.spinner(text=message.capitalize() + '...'):
-    status = solver.Solve(model)
+
+st.success('Done reading data from spreadsheet')
+if run['unchanged']:
+    st.caption('Input unchanged since the last run (parsed data reused)')
+log = st.expander("Log", expanded=False)
+for message in run['warnings']:
+    log.warning(message, icon="⚠️")
+
+
+#### Solve progress ####
+message = f'solving scheduling problem (limiting to {run["time_limit_mins"]}m)'
+time_limit_secs = run['time_limit_mins'] * 60.0
+if not job.done():
+    st.progress(min(job.elapsed() / time_limit_secs, 1.0),
+                text=message.capitalize() + f'... ({job.elapsed():.0f}s)')
+
+if job.progress:
+    st.line_chart([{'time (s)': t, 'satisfied gaps': objective, 'bound': bound}
+                   for t, objective, bound in job.progress],
+                  x='time (s)', y=['satisfied gaps', 'bound'])
+if job.watched_values is not None:
+    st.metric('Unsatisfied gap requests', len(ideal_bools) - int(sum(job.watched_values)))
+
+if not job.done():
+    # StopSearch keeps the best solution found so far
+    if st.button('Cancel'):
+        job.cancel()
+        job.wait()
+    else:
+        time.sleep(1)
+    st.rerun()
+
+if job.error is not None:
+    st.error(f'Solver failed: {job.error}')
+    st.stop()
+
+solver = job.solver
+status = job.status
 
 # determine success & status
 success = (status in [cp_model.OPTIMAL, cp_model.FEASIBLE])
@@ -363,7 +412,7 @@ else: #cp_model.UNKNOWN
 
 if success:
     # Solution found!
-    st.balloons()
+    if not run['output_written']: st.balloons()
     # message = 'an OPTIMAL' if status == cp_model.OPTIMAL else 'a FEASIBLE'
     st.success(f'{status_name} solution found')
 
@@ -388,9 +437,16 @@ if success:
     
 elif status == cp_model.INFEASIBLE:
     st.error('The scheduling problem was proven infeasible :( Try relaxing some hard constraints.')
+elif job.cancelled:
+    st.error('Cancelled before a solution was found.')
 else: # status == cp_model.UNKNOWN
     st.error('No solution found within time limit :( Try increasing the limit.')
 
+# Write the output only once per solve (the page may rerun afterwards)
+if run['output_written']:
+    st.stop()
+run['output_written'] = True
+
 
 #### Save solution to the Google Sheet ####
 message = "writing output to spreadsheet"
@@ -0,0 +1,104 @@
+import json
+import random
+import argparse
+from datetime import date, timedelta
+
+#### Synthetic workbooks ####
+# Generates workbooks shaped like the real input sheets: exams named
+# '<faculty>-<course>-<moed>' (e.g. '0368-2157-a'), grouped into study tracks
+# that share a course-code prefix, so constraint rows use '#' wildcards and
+# back-references the same way the coordinators' rows do.
+
+HEADER_ROWS = 2
+
+def _sheet(rows, header_rows=HEADER_ROWS):
+    return [[''] for _ in range(header_rows)] + [[''] + row for row in rows]
+
+def generate_workbook(num_exams, seed=0, start_date=date(2025, 1, 19)):
+    """Returns a workbook (sheet name -> rows) with about `num_exams` exams."""
+    rng = random.Random(seed)
+
+    # courses, two exams (moed a/b) each, grouped into tracks of 3-8 courses
+    num_courses = max(1, num_exams // 2)
+    courses = []
+    tracks = []
+    faculty = 368
+    while len(courses) < num_courses:
+        faculty += rng.randint(1, 5)
+        for hundreds in range(10, 100, rng.randint(3, 9)):
+            track = [f'{faculty:04d}-{hundreds:02d}{course:02d}' for course in rng.sample(range(100), rng.randint(3, 8))]
+            # (the last track is cut to the requested number of courses)
+            track = track[:num_courses - len(courses)]
+            courses.extend(track)
+            if track: tracks.append(track)
+            if len(courses) == num_courses: break
+
+    assert len(courses) == num_courses
+
+    exams = []
+    demands = {}
+    for course in courses:
+        demand = int(min(400, rng.lognormvariate(3.5, 0.8))) + 5
+        for moed in 'ab':
+            exams.append(f'{course}-{moed}')
+            demands[exams[-1]] = demand if moed == 'a' else max(5, demand // 3)
+
+    # dates: working days only get capacity, Saturdays none and Fridays less
+    total_demand = sum(demands.values())
+    num_dates = max(60, min(160, 40 + num_exams // 150))
+    days = [start_date + timedelta(t) for t in range(num_dates)]
+    weights = [0 if d.weekday() == 5 else 0.4 if d.weekday() == 4 else rng.uniform(0.7, 1.3) for d in days]
+    # (small instances still need room for their largest exams)
+    scale = max(1.6 * total_demand / sum(weights), 2 * max(demands.values()))
+    capacities = [int(w * scale) for w in weights]
+    # an oversized date (e.g. a hall rented for the day)
+    capacities[rng.randrange(num_dates)] *= 5
+
+    date_labels = [d.strftime('%d/%m/%Y') for d in days]
+    working = [t for t, c in enumerate(capacities) if c > 0]
+
+    # fixed dates: a few exams plus dummy (omitted) holiday events
+    fixes = []
+    for exam in rng.sample(exams[::2], max(1, len(exams) // 200)):
+        t = rng.choice(working[:len(working)//2])
+        if demands[exam] <= capacities[t] // 4:
+            fixes.append([exam, date_labels[t]])
+    for k in range(max(1, num_dates // 30)):
+        fixes.append([f'%holiday {k}', date_labels[rng.randrange(1, num_dates)]])
+
+    # gaps: moed b some weeks after moed a, and gaps within each track
+    gaps = [[r'(####-####)-a', r'\1-b', '14', '21', '1']]
+    precedences = [[r'(####-####)-a', r'\1-b']]
+    for track in tracks:
+        prefix = track[0][:7]
+        if len(track) < 2: continue
+        min_days = str(rng.choice([1, 2]))
+        ideal_days = str(int(min_days) + rng.choice([1, 2, 3]))
+        gaps.append([f'{prefix}##-a', f'{prefix}##-a', min_days, ideal_days, str(rng.randint(1, 5))])
+        if rng.random() < 0.3:
+            other = rng.choice(tracks)[0][:7]
+            gaps.append([f'{prefix}##-a', f'{other}##-a', '', '2', '1'])
+        if rng.random() < 0.2:
+            # a prerequisite course is examined first
+            first, second = rng.sample(track, 2)
+            precedences.append([f'{first}-a', f'{second}-a'])
+
+    return {
+        'בחינות': _sheet([[exam, str(demands[exam])] for exam in exams]),
+        'תאריכים': _sheet([[label, str(c)] for label, c in zip(date_labels, capacities)]),
+        'קיבועים': _sheet(fixes),
+        'מרווחים': _sheet(gaps),
+        'קדימויות': _sheet(precedences),
+        'שיבוץ': _sheet([], header_rows=3),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a synthetic JSON workbook')
+    parser.add_argument('--exams', type=int, default=1000, help='Approximate number of exams')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    parser.add_argument('--output', required=True, help='Output JSON workbook file')
+    args = parser.parse_args()
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(generate_workbook(args.exams, args.seed), f, ensure_ascii=False)
@@ -0,0 +1,42 @@
+import os
+import time
+from persistence import BackgroundWriter
+from workbook import FakeWorkbook
+
+WORKBOOK = os.path.join(os.path.dirname(__file__), 'fixtures', 'workbook.json')
+
+
+def stream_writer(latency, min_interval):
+    # streams each incumbent (here a number) to the output sheet, as the
+    # scheduler does with stream_interval_in_secs
+    sheet = FakeWorkbook.from_json(WORKBOOK, latency=latency).worksheet('שיבוץ')
+    writer = BackgroundWriter(lambda item: sheet.update(range_name='B3', values=[[item]]), min_interval)
+    return sheet, writer
+
+
+def test_stream_is_throttled_and_flushes_the_last_incumbent():
+    sheet, writer = stream_writer(latency=0.02, min_interval=0.2)
+    start_time = time.monotonic()
+    for k in range(100):
+        writer.submit(k)
+        time.sleep(0.005)
+    writer.close()
+    elapsed = time.monotonic() - start_time
+
+    assert 1 < writer.write_count <= elapsed / 0.2 + 2
+    assert sheet.request_count == writer.write_count
+    assert sheet.rows[2][1] == 99
+
+
+def test_slow_sheet_does_not_block_submit():
+    sheet, writer = stream_writer(latency=0.5, min_interval=0)
+    start_time = time.monotonic()
+    for k in range(10):
+        writer.submit(k)
+    assert time.monotonic() - start_time < 0.1
+    writer.close()
+
+    # at most the first item (if picked up before the others arrive) and the
+    # last are written
+    assert writer.write_count <= 2
+    assert sheet.rows[2][1] == 9
@@ -0,0 +1,26 @@
+import os
+from instance import INPUT_SHEETS, parse_instance
+from workbook import GSheetWorkbook, FakeWorkbook
+
+# a small synthetic workbook (synthetic.py --exams 40 --seed 0)
+WORKBOOK = os.path.join(os.path.dirname(__file__), 'fixtures', 'workbook.json')
+
+
+def test_read_sheets_is_one_batched_request():
+    spreadsheet = FakeWorkbook.from_json(WORKBOOK)
+    workbook = GSheetWorkbook(spreadsheet)
+    sheets = workbook.read_sheets(list(INPUT_SHEETS))
+
+    assert spreadsheet.request_count == 1
+    assert workbook.request_count == 1
+    # no per-sheet reads
+    assert all(ws.request_count == 0 for ws in spreadsheet.worksheets.values())
+    assert sheets == FakeWorkbook.from_json(WORKBOOK).read_sheets(list(INPUT_SHEETS))
+
+
+def test_batched_sheets_parse():
+    sheets = GSheetWorkbook(FakeWorkbook.from_json(WORKBOOK)).read_sheets(list(INPUT_SHEETS))
+    instance = parse_instance(sheets, lambda line: None)
+    # 40 exams and 2 holiday dummies
+    assert instance.num_exams == 42
+    assert instance.min_days_between_exams and instance.exam_before_exam
@@ -0,0 +1,116 @@
+from model import date_windows
+
+#### Warm start ####
+# A full warm start hints every exam with its date in a previous schedule.
+# Dates that break a hard constraint of the current instance (a new fixed
+# date, gap or precedence, or a reduced capacity) are first repaired
+# greedily, so that the hint is a complete, (near-)feasible solution, and the
+# ideal-gap violation literals (and the auxiliary variables of the chosen
+# encodings) are hinted consistently with it.
+
+def repair_schedule(instance, previous):
+    """Returns (schedule, repaired, unplaced): a date for each exam, keeping
+    its `previous` date whenever that is consistent with the hard constraints
+    and the exams placed before it, else moving it to the nearest consistent
+    date. `repaired` lists exams moved from (or given) a date, `unplaced`
+    exams with no consistent date (kept at their previous date, if any)."""
+    num_exams, horizon = instance.num_exams, instance.horizon
+    demands, capacity = instance.exam_demands, instance.dates_capacity
+    earliest, latest = date_windows(instance)
+
+    gaps = [[] for _ in range(num_exams)]
+    for (i, j), days in instance.min_days_between_exams.items():
+        if days < 1: continue
+        gaps[i].append((j, days))
+        gaps[j].append((i, days))
+    predecessors = [[] for _ in range(num_exams)]
+    successors = [[] for _ in range(num_exams)]
+    for i, j in instance.exam_before_exam:
+        successors[i].append(j)
+        predecessors[j].append(i)
+
+    schedule = dict(instance.exam_on_date)
+    load = [0] * horizon
+    for i, t in schedule.items():
+        load[t] += demands[i]
+
+    def consistent(i, t):
+        if load[t] + demands[i] > capacity[t]: return False
+        if any(j in schedule and abs(schedule[j] - t) < days for j, days in gaps[i]): return False
+        if any(j in schedule and schedule[j] > t for j in predecessors[i]): return False
+        if any(j in schedule and schedule[j] < t for j in successors[i]): return False
+        return True
+
+    # previously scheduled exams in date order, then new exams
+    free = [i for i in range(num_exams) if i not in schedule]
+    free.sort(key=lambda i: (previous.get(i, horizon), i))
+
+    repaired, unplaced = [], []
+    for i in free:
+        p = previous.get(i)
+        dates = range(earliest[i], latest[i] + 1)
+        if p is not None:
+            # nearest dates first (the previous one, if still allowed)
+            dates = sorted(dates, key=lambda t: (abs(t - p), t))
+        else:
+            # least loaded dates first
+            dates = sorted(dates, key=lambda t: (load[t] / capacity[t] if capacity[t] else 1, t))
+
+        t = next((t for t in dates if consistent(i, t)), None)
+        if t is None:
+            unplaced.append(i)
+            if p is None: continue
+            t = p
+        elif t != p:
+            repaired.append(i)
+        schedule[i] = t
+        load[t] += demands[i]
+
+    return schedule, repaired, unplaced
+
+
+def add_full_hints(model, exams, ideal_violations, auxiliary, instance, schedule):
+    """Hints every exam variable with its date in `schedule`, every violation
+    literal with whether its ideal gap holds there, and the `auxiliary`
+    variables of the ideal-gap and capacity encodings (as returned by
+    build_model) consistently. Returns the number of hinted variables."""
+    # shared intervals (one per exam and length) are present only if all
+    # pairs of that length of the exam hold, and a pair holds only if both are
+    shared = 'present' in auxiliary
+    present = {}
+    if shared:
+        for (i, j), days in instance.ideal_days_between_exams.items():
+            if days < 1 or i not in schedule or j not in schedule: continue
+            holds = abs(schedule[i] - schedule[j]) >= days
+            present[(i, days)] = present.get((i, days), True) and holds
+            present[(j, days)] = present.get((j, days), True) and holds
+
+    count = 0
+    for i, var in enumerate(exams):
+        if isinstance(var, int) or i not in schedule: continue
+        model.AddHint(var, schedule[i])
+        count += 1
+    for (i, j), literal in ideal_violations.items():
+        if i not in schedule or j not in schedule: continue
+        days = instance.ideal_days_between_exams[(i, j)]
+        if shared:
+            violated = not (present[(i, days)] and present[(j, days)])
+        else:
+            violated = abs(schedule[i] - schedule[j]) < days
+        model.AddHint(literal, int(violated))
+        count += 1
+
+    # the value of each kind of auxiliary variable, by its key
+    values = {
+        'before': lambda i, j: int(schedule[j] >= schedule[i]) if i in schedule and j in schedule else None,
+        'distance': lambda i, j: abs(schedule[i] - schedule[j]) if i in schedule and j in schedule else None,
+        'present': lambda i, days: int(present[(i, days)]) if (i, days) in present else None,
+        'on_date': lambda i, t: int(schedule[i] == t) if i in schedule else None,
+    }
+    for kind, variables in auxiliary.items():
+        for (a, b), var in variables.items():
+            value = values[kind](a, b)
+            if value is None: continue
+            model.AddHint(var, value)
+            count += 1
+    return count
@@ -0,0 +1,160 @@
+import re
+import json
+import time
+import hashlib
+
+#### Workbook backends ####
+# A workbook is anything with `read_sheets(sheet_names)`, returning the full
+# values of each worksheet as a list of equal-length rows (like gspread's
+# `get_all_values()`), and `worksheet(sheet_name)` returning an object that
+# supports the gspread write calls used by the scheduler.
+
+def pad_rows(rows):
+    # pad ragged rows with empty strings, as `get_all_values()` does
+    width = max((len(row) for row in rows), default=0)
+    return [list(row) + [''] * (width - len(row)) for row in rows]
+
+
+class GSheetWorkbook:
+    """Google Sheets workbook, read with a single batched values request."""
+
+    def __init__(self, spreadsheet):
+        self.spreadsheet = spreadsheet
+        self.request_count = 0
+
+    @classmethod
+    def open(cls, gc, sheet_url):
+        return cls(gc.open_by_url(sheet_url))
+
+    def read_sheets(self, sheet_names):
+        # a range consisting of a sheet title covers the whole sheet
+        ranges = ["'{}'".format(name.replace("'", "''")) for name in sheet_names]
+        response = self.spreadsheet.values_batch_get(ranges)
+        self.request_count += 1
+
+        value_ranges = response.get('valueRanges', [])
+        return {name: pad_rows(value_range.get('values', []))
+                for name, value_range in zip(sheet_names, value_ranges)}
+
+    def worksheet(self, sheet_name):
+        return self.spreadsheet.worksheet(sheet_name)
+
+def values_hash(sheets):
+    # cheap change check of fetched sheet values (sheet name -> rows)
+    return hashlib.sha256(json.dumps(sheets, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
+
+def a1_to_rowcol(label):
+    # 'C12' -> (12, 3); a bare column 'C' yields row None
+    m = re.fullmatch(r'([A-Za-z]+)(\d*)', label)
+    if not m:
+        raise ValueError(f'Invalid cell label: {label}')
+    col = 0
+    for c in m.group(1).upper():
+        col = col*26 + ord(c) - ord('A') + 1
+    row = int(m.group(2)) if m.group(2) else None
+    return row, col
+
+
+class FakeWorksheet:
+    """In-memory stand-in for a gspread worksheet (1-based A1 ranges)."""
+
+    def __init__(self, title, rows=None, row_count=1000, latency=0.0):
+        self.title = title
+        self.rows = [list(row) for row in (rows or [])]
+        self.row_count = max(row_count, len(self.rows))
+        self.latency = latency
+        self.request_count = 0
+        self.formats = []
+
+    def _request(self):
+        self.request_count += 1
+        if self.latency > 0: time.sleep(self.latency)
+
+    def _range(self, range_name):
+        start, _, end = range_name.partition(':')
+        row1, col1 = a1_to_rowcol(start)
+        row2, col2 = a1_to_rowcol(end) if end else (row1, col1)
+        return row1 or 1, col1, row2 or self.row_count, col2
+
+    def _set(self, row, col, value):
+        while len(self.rows) < row:
+            self.rows.append([])
+        cells = self.rows[row-1]
+        if len(cells) < col:
+            cells.extend([''] * (col - len(cells)))
+        cells[col-1] = value
+        self.row_count = max(self.row_count, row)
+
+    def get_all_values(self):
+        self._request()
+        return pad_rows(self.rows)
+
+    def update(self, range_name=None, values=None, major_dimension='ROWS', **kwargs):
+        self._request()
+        row1, col1, _, _ = self._range(range_name)
+        values = values or []
+        if major_dimension == 'COLUMNS':
+            for j, column in enumerate(values):
+                for i, value in enumerate(column):
+                    self._set(row1+i, col1+j, value)
+        else:
+            for i, row in enumerate(values):
+                for j, value in enumerate(row):
+                    self._set(row1+i, col1+j, value)
+
+    def batch_clear(self, ranges):
+        self._request()
+        for range_name in ranges:
+            row1, col1, row2, col2 = self._range(range_name)
+            for cells in self.rows[row1-1:row2]:
+                for col in range(col1, min(col2, len(cells)) + 1):
+                    cells[col-1] = ''
+
+    def format(self, range_name, cell_format):
+        self._request()
+        self.formats.append((range_name, cell_format))
+
+
+class FakeWorkbook:
+    """In-memory or file-backed workbook, for running and timing offline.
+
+    `latency` simulates the duration of one API round trip (in seconds), and
+    `request_count` counts round trips, so that read paths can be measured and
+    regression-tested without network access. It also stands in for the
+    gspread spreadsheet of a `GSheetWorkbook` (`values_batch_get`)."""
+
+    def __init__(self, sheets, latency=0.0):
+        self.latency = latency
+        self.request_count = 0
+        self.worksheets = {name: FakeWorksheet(name, rows, latency=latency)
+                           for name, rows in sheets.items()}
+
+    @classmethod
+    def from_json(cls, fname, latency=0.0):
+        with open(fname, 'r', encoding='utf-8') as f:
+            return cls(json.load(f), latency=latency)
+
+    def to_json(self, fname):
+        sheets = {name: ws.rows for name, ws in self.worksheets.items()}
+        with open(fname, 'w', encoding='utf-8') as f:
+            json.dump(sheets, f, ensure_ascii=False)
+
+    def read_sheets(self, sheet_names):
+        self.request_count += 1
+        if self.latency > 0: time.sleep(self.latency)
+        return {name: pad_rows(self.worksheets[name].rows) for name in sheet_names}
+
+    def values_batch_get(self, ranges):
+        # whole-sheet ranges only ('Sheet' or quoted "'Sheet'")
+        self.request_count += 1
+        if self.latency > 0: time.sleep(self.latency)
+        names = [r[1:-1].replace("''", "'") if r.startswith("'") else r for r in ranges]
+        return {'valueRanges': [{'range': r, 'values': [list(row) for row in self.worksheets[name].rows]}
+                                for r, name in zip(ranges, names)]}
+
+    def worksheet(self, sheet_name):
+        if sheet_name not in self.worksheets:
+            # sheets written by the scheduler (log, stats) may not exist yet
+            self.worksheets[sheet_name] = FakeWorksheet(sheet_name, latency=self.latency)
+        return self.worksheets[sheet_name]